@@ -0,0 +1,254 @@
+"""
+/api/v1: batches, scans, findings and executions as json.
+
+    GET /api/v1/<resource>?<filter>=..&fields=a,b&limit=100&cursor=..&count=1
+    GET /api/v1/<resource>/<id>?fields=a,b
+
+Lists are newest first and paginated by id: pass the response's next_cursor
+as cursor to get the next page (next_cursor is null on the last one).
+Filters can be repeated (?level=High&level=Medium), from/to take iso dates.
+count=1 adds the number of items matching the filters.
+
+    GET /api/v1/search?q=..&kind=findings|output&limit=50&batch=..&scan=..
+
+Full-text search (see search.py), hits are best first.
+"""
+import datetime
+
+from flask import Blueprint, request
+
+from model import BatchExec, ScannerExec, ScanFinding, Execution
+import search
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ApiError(ValueError):
+    pass
+
+
+def _date(value: str) -> datetime.datetime:
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'Invalid date: {value}')
+
+
+def _int(value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f'Invalid number: {value}')
+
+
+def _limit(default: int, maximum: int) -> int:
+    """ the request's limit, at most maximum """
+    limit = _int(request.args.get('limit', default))
+    if limit < 1:
+        raise ApiError(f'Invalid limit: {limit} (1 to {maximum})')
+    return min(limit, maximum)
+
+
+def _bool(value: str) -> bool:
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def one_of(field, convert=str):
+    """ filter: field in the values given """
+    return lambda values: field.in_([convert(v) for v in values])
+
+
+def since(field):
+    return lambda values: field >= _date(values[-1])
+
+
+def until(field):
+    return lambda values: field < _date(values[-1])
+
+
+class Resource:
+    def __init__(self, model, fields: dict, filters: dict, joins=None):
+        """ fields: name -> model field, filters: argument -> (values -> where clause),
+            joins: filters needing the scan joined """
+        self.model = model
+        self.fields = fields
+        self.filters = filters
+        self.joins = joins or set()
+
+    def selected(self, names):
+        if not names:
+            return self.fields
+        unknown = [n for n in names if n not in self.fields]
+        if unknown:
+            raise ApiError(f'Unknown fields: {", ".join(unknown)} (valid: {", ".join(self.fields)})')
+        return {n: self.fields[n] for n in names}
+
+    def query(self, fields: dict, args):
+        query = self.model.select(*[field.alias(name) for name, field in fields.items()])
+        if self.joins & set(args):
+            query = query.join(ScannerExec)
+        for arg, where in self.filters.items():
+            values = args.getlist(arg)
+            if values:
+                query = query.where(where(values))
+        return query
+
+
+RESOURCES = {
+    'batches': Resource(BatchExec, {
+        'id': BatchExec.id,
+        'timestamp': BatchExec.timestamp,
+        'name': BatchExec.name,
+        'author': BatchExec.author,
+        'email': BatchExec.email,
+        'comments': BatchExec.comments,
+        'incremental': BatchExec.incremental,
+    }, {
+        'name': one_of(BatchExec.name),
+        'author': one_of(BatchExec.author),
+        'from': since(BatchExec.timestamp),
+        'to': until(BatchExec.timestamp),
+    }),
+    'scans': Resource(ScannerExec, {
+        'id': ScannerExec.id,
+        'batch': ScannerExec.batch,
+        'timestamp': ScannerExec.timestamp,
+        'repo': ScannerExec.repo,
+        'commit': ScannerExec.commit,
+        'rev_hash': ScannerExec.rev_hash,
+        'path': ScannerExec.path,
+        'scanner': ScannerExec.scanner,
+        'scanner_version': ScannerExec.scanner_version,
+        'status': ScannerExec.status,
+        'status_at': ScannerExec.status_at,
+        'errors': ScannerExec.errors,
+        'carried_from': ScannerExec.carried_from,
+    }, {
+        'batch': one_of(ScannerExec.batch, _int),
+        'repo': one_of(ScannerExec.repo),
+        'path': one_of(ScannerExec.path),
+        'scanner': one_of(ScannerExec.scanner),
+        'status': one_of(ScannerExec.status),
+        'from': since(ScannerExec.timestamp),
+        'to': until(ScannerExec.timestamp),
+    }),
+    'findings': Resource(ScanFinding, {
+        'id': ScanFinding.id,
+        'scan': ScanFinding.scan,
+        'partial': ScanFinding.partial,
+        'name': ScanFinding.name,
+        'desc': ScanFinding.desc,
+        'category': ScanFinding.category,
+        'level': ScanFinding.level,
+        'filename': ScanFinding.filename,
+        'lineno': ScanFinding.lineno,
+        'scanner': ScanFinding.scanner,
+        'fingerprint': ScanFinding.fingerprint,
+        'jsonextra': ScanFinding.jsonextra,
+    }, {
+        'scan': one_of(ScanFinding.scan, _int),
+        'level': one_of(ScanFinding.level),
+        'scanner': one_of(ScanFinding.scanner),
+        'name': one_of(ScanFinding.name),
+        'fingerprint': one_of(ScanFinding.fingerprint),
+        'partial': lambda values: ScanFinding.partial == _bool(values[-1]),
+        'batch': one_of(ScannerExec.batch, _int),
+        'repo': one_of(ScannerExec.repo),
+        'from': since(ScannerExec.timestamp),
+        'to': until(ScannerExec.timestamp),
+    }, joins={'batch', 'repo', 'from', 'to'}),
+    'executions': Resource(Execution, {
+        'id': Execution.id,
+        'scan': Execution.scan,
+        'kind': Execution.kind,
+        'cmdargs': Execution.cmdargs,
+        'wd': Execution.wd,
+        'ret': Execution.ret,
+        'timestamp': Execution.timestamp,
+        'duration': Execution.duration,
+        'killed': Execution.killed,
+        'cpu_seconds': Execution.cpu_seconds,
+        'mem_peak': Execution.mem_peak,
+    }, {
+        'scan': one_of(Execution.scan, _int),
+        'kind': one_of(Execution.kind),
+        'ret': one_of(Execution.ret, _int),
+        'killed': one_of(Execution.killed),
+        'batch': one_of(ScannerExec.batch, _int),
+        'from': since(Execution.timestamp),
+        'to': until(Execution.timestamp),
+    }, joins={'batch'}),
+}
+
+
+def _json(row: dict) -> dict:
+    return {k: str(v) if isinstance(v, (datetime.datetime, datetime.date)) else v
+            for k, v in row.items()}
+
+
+def _resource(name) -> Resource:
+    if name not in RESOURCES:
+        raise ApiError(f'Unknown resource: {name} (valid: {", ".join(RESOURCES)})')
+    return RESOURCES[name]
+
+
+def _fields(resource: Resource) -> dict:
+    names = request.args.get('fields')
+    fields = resource.selected(names.split(',') if names else None)
+    # the cursor is the id
+    return dict(fields, id=resource.model.id)
+
+
+@api.errorhandler(ApiError)
+def api_error(err):
+    return {'error': str(err)}, 400
+
+
+@api.route('/search')
+def search_hits():
+    query, kind = request.args.get('q', ''), request.args.get('kind', 'findings')
+    limit = _limit(search.DEFAULT_LIMIT, search.MAX_LIMIT)
+    try:
+        if kind == 'findings':
+            batch = request.args.get('batch')
+            hits = search.findings(query, limit, batch=_int(batch) if batch else None)
+        elif kind == 'output':
+            scan = request.args.get('scan')
+            hits = search.output(query, limit, scan=_int(scan) if scan else None)
+        else:
+            raise ApiError(f'Unknown kind: {kind} (valid: {", ".join(search.KINDS)})')
+    except search.SearchError as err:
+        raise ApiError(str(err))
+    return {'items': hits}
+
+
+@api.route('/<name>')
+def listing(name: str):
+    resource = _resource(name)
+    fields = _fields(resource)
+    limit = _limit(DEFAULT_LIMIT, MAX_LIMIT)
+    query = resource.query(fields, request.args)
+    result = {}
+    if _bool(request.args.get('count', '')):
+        result['count'] = query.count()
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.where(resource.model.id < _int(cursor))
+    items = list(query.order_by(resource.model.id.desc()).limit(limit).dicts())
+    result['items'] = [_json(item) for item in items]
+    result['next_cursor'] = str(items[-1]['id']) if len(items) == limit else None
+    return result
+
+
+@api.route('/<name>/<int:id>')
+def item(name: str, id: int):
+    resource = _resource(name)
+    fields = _fields(resource)
+    row = (resource.model.select(*[field.alias(n) for n, field in fields.items()])
+           .where(resource.model.id == id).dicts().first())
+    if row is None:
+        return {'error': f'{name} {id} not found'}, 404
+    return _json(row)
@@ -1,102 +1,148 @@
+import datetime
 import html
 import json
 import os
 
-import dramatiq
-from dramatiq.brokers.redis import RedisBroker
-from flask import Flask, request, url_for, redirect, Response
+from flask import Flask, request, url_for, redirect, Response, stream_with_context, send_file, abort
 
-from model import BatchExec, ScannerExec, Execution, Report, get_scans
+from model import db, BatchExec, BatchSummary, ScannerExec, ScanFinding, Execution, Report, RebuildJob, Counter, get_scans
 from helperfuncs import render, to_str
+from metrics import render_metrics
+import export
+import search
+import submit
+from api import api
+import httpcache
+import profiling
 
-from drunner import generic_task_runner, execute_batch, ScannerRunner
+from drunner import generic_task_runner, execute_batch, rebuild_reports_task, ScannerRunner, setup_broker
 
 
 app = Flask(__name__)
-REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
-redis_broker = RedisBroker(host=REDIS_HOST)
-dramatiq.set_broker(redis_broker)
+httpcache.init_app(app)
+profiling.init_app(app)
+app.register_blueprint(api)
+
+
+@app.before_request
+def db_connect():
+    db.connect(reuse_if_open=True)
+
+
+@app.teardown_request
+def db_close(exc):
+    if not db.is_closed():
+        db.close()
 
 
 def get_app():
     return app
 
 
+def create_app(broker=None):
+    """ the app to serve, ie: gunicorn -c gunicorn.conf.py (which runs 'app:create_app()') """
+    setup_broker(broker)
+    return app
+
+
 @app.route('/')
 def index():  # put application's code here
     return render("index.html")
 
 
+def exec_etag(exec: Execution):
+    """ None while it runs, its output can still change """
+    return None if exec.ret is None else f'exec-{exec.id}-{exec.ret}'
+
+
+def exec_end(exec: Execution):
+    if exec.timestamp is None or exec.duration is None:
+        return None
+    return exec.timestamp + datetime.timedelta(seconds=exec.duration)
+
+
+def report_etag(report: Report):
+    return f'report-{report.id}-{report.timestamp.timestamp() if report.timestamp else 0}'
+
+
 @app.route('/exec/<eid>')
 def exec(eid: int):  # put application's code here
     exec = Execution().get_by_id(eid)
     # lines = [line for line in exec.output_line]
     # lines.sort(key=lambda line: line.idx)
-    return render("exec.html",
-                  exec_fields={},
-                  exec=exec)
-
-def last_path_no_dot(astr: str) -> str:
-    if '/' in astr:
-        astr = astr.split('/')[-1]
-    if '.' in astr:
-        astr = astr.split('.')[0]
-    return astr
+    build = lambda: render("exec.html",
+                           exec_fields={},
+                           exec=exec)
+    etag = exec_etag(exec)
+    if etag is None:
+        return build()
+    return httpcache.conditional(
+        httpcache.page_etag(etag, Counter.Get(Counter.SIDEBAR)), None, build)
 
 @app.route('/batch/<id>/composite')
-def batch_composite(id: int):  # put application's code here
+def batch_composite(id: int):
+    """ the batch's findings: ?format=csv|ndjson|parquet|arrow, &columns=a,b..,
+        &level=.. and &scanner=.. (repeatable), &partial=1 for the findings
+        seen so far of the running scans """
     batch = BatchExec().get_by_id(id)
-    full = [','.join([
-        'scanner',
-        #'s.version',
-        'repo name',
-        'repo url',
-        'commit',
-        'revision',
-        'path',
-        'finding',
-        'level',
-        'filename',
-        'lineno'
-    ])]
-    for scan, finding in batch.composite_report():
-        full.append(','.join([
-            finding['scanner'],
-            #scan.scanner_version,
-            last_path_no_dot(scan.repo),
-            scan.repo,
-            scan.commit,
-            scan.rev_hash,
-            scan.path,
-            finding['name'],
-            finding['level'],
-            finding['filename'],
-            str(finding['lineno'])
-        ]))
+    columns = request.args.get('columns')
+    try:
+        content, mimetype, extension = export.export(
+            batch.id, request.args.get('format', 'csv'),
+            columns=columns.split(',') if columns else None,
+            levels=request.args.getlist('level'),
+            scanners=request.args.getlist('scanner'),
+            partial=request.args.get('partial') == '1')
+    except export.ExportError as err:
+        return Response(str(err), status=400, mimetype='text/plain')
     return Response(
-        '\r\n'.join(full),
-        mimetype='text/plain',
+        stream_with_context(content),
+        mimetype=mimetype,
         headers={'Content-disposition':
-                     f'attachment; filename=batch-{batch.name}-{id}.csv'})
+                     f'attachment; filename=batch-{batch.name}-{id}.{extension}'})
 
 
 @app.route('/batch/<id>')
 def batch(id: int):  # put application's code here
     batch = BatchExec().get_by_id(id)
-    return render('batch.html', batch=batch)
+    return render('batch.html', batch=batch, summary=BatchSummary.Get(batch.id))
+
+@app.route('/batch/<id>/status')
+def batch_status(id: int):
+    """ the batch's counters, for polling: a single row read """
+    return BatchSummary.Get(int(id)).as_dict()
+
+@app.route('/batch/<id>/diff/<other_id>')
+def batch_diff(id: int, other_id: int):
+    """ findings added, removed and unchanged from batch id to batch other_id """
+    batch, other = BatchExec.get_by_id(id), BatchExec.get_by_id(other_id)
+    diff = batch.diff(other)
+    added, removed = ScanFinding.WithScans(diff['added']), ScanFinding.WithScans(diff['removed'])
+    if request.args.get('format') == 'json':
+        def rows(found):
+            return [dict(f.as_dict(), repo=scan.repo, path=scan.path) for scan, f in found]
+        return {'added': rows(added), 'removed': rows(removed), 'unchanged': len(diff['unchanged'])}
+    return render('batch_diff.html', batch=batch, other=other, added=added, removed=removed,
+                  unchanged=len(diff['unchanged']))
+
 
 @app.route('/report/<id>')
 def report(id: int):  # put application's code here
     report = Report().get_by_id(id)
-    return render('report.html', report=report)
+    return httpcache.conditional(
+        httpcache.page_etag(report_etag(report), Counter.Get(Counter.SIDEBAR)), report.timestamp,
+        lambda: render('report.html', report=report))
 
 @app.route('/report/<id>/download')
 def report_download(id: int):  # put application's code here
-    report = Report().get_by_id(id)
-    return Response(
-        report.content,
-        mimetype='text/plain',
-        headers={'Content-disposition': f'attachment; filename=report-{id}'})
+    # the content is only read if the client's copy is stale
+    report = Report.select(Report.id, Report.timestamp).where(Report.id == id).get()
+    return httpcache.conditional(
+        report_etag(report), report.timestamp,
+        lambda: Response(
+            stream_with_context(Report.get_by_id(id).iter_content()),
+            mimetype='text/plain',
+            headers={'Content-disposition': f'attachment; filename=report-{id}'}))
 
 @app.route('/report/<id>/name')
 def report_name(id: int):  # put application's code here
@@ -108,10 +154,30 @@ def get_exec_output(id: int):  # put application's code here
     if not exec:
         return 'Not found', 404
     fname = exec.get_output_fname()
-    return Response(
+    build = lambda: Response(
         exec.output,
         mimetype='text/plain',
         headers={'Content-disposition': f'attachment; filename={fname}'})
+    etag = exec_etag(exec)
+    if etag is None:
+        return build()
+    return httpcache.conditional(etag, exec_end(exec), build)
+
+
+@app.route('/exec/<id>/lines')
+def exec_lines(id: int):
+    """ output lines ?before=<line id> or ?after=<line id> (the last ones without them),
+        up to ?limit= """
+    exec = Execution.select(Execution.id, Execution.ret).where(Execution.id == id).get()
+    before, after = request.args.get('before', type=int), request.args.get('after', type=int)
+    limit = min(request.args.get('limit', Execution.TAIL_LINES, type=int), 5000)
+    lines = exec.lines(before=before, after=after, limit=limit)
+    return {
+        'lines': [[line.id, line.is_out, line.line] for line in lines],
+        # limit lines were returned: there may be more
+        'more': len(lines) == limit,
+        'finished': exec.ret is not None,
+    }
 
 
 def split_ms(a_str:str):
@@ -127,6 +193,20 @@ def rebuild(scan_id: int):
     return redirect(url_for('scan_exec', id=scan_id))
 
 
+@app.route('/scan/<scan_id>/cancel')
+def cancel_scan(scan_id: int):
+    scan_id = int(scan_id)
+    ScannerExec.Cancel(ScannerExec.id == scan_id)
+    return redirect(url_for('scan_exec', id=scan_id))
+
+
+@app.route('/batch/<id>/cancel')
+def cancel_batch(id: int):
+    id = int(id)
+    ScannerExec.Cancel(ScannerExec.batch == id)
+    return redirect(url_for('batch', id=id))
+
+
 @app.route('/info/')
 def scanners():
     info = {
@@ -147,23 +227,26 @@ def scan_exec(id: int):  # put application's code here
                           (k == scanner), # is static
                           'datetime-local' if k==timestamp else None, # special_field
                           )
-    big_fields = {}
-    for k in ['errors']:
-        big_fields[k] = to_str(getattr(scan, k))
 
-    reports = list(scan.reports)
-    if len(reports)>=2:
-        gen = [r for r in reports if not r.is_raw ][0]
-        lines =  [str(finding) for finding in json.loads(gen.content)['findings'] ]
-        big_fields['report'] = '\r\n'.join(lines)
-
-        raw = [r for r in reports if r.is_raw][0]
-        big_fields['raw'] = raw.content
-
-    return render("scan.html",
-                  scan=scan,
-                  exec_fields=exec_fields,
-                  big_fields=big_fields)
+    etag = None
+    # a cancelled scan is finished before its execution is killed
+    if scan.finished and not scan.execs.where(Execution.ret.is_null()).exists():
+        # reports are only written again by rebuilds, which stamp them
+        stamps = scan.reports.select(Report.id, Report.timestamp).order_by(Report.id)
+        etag = httpcache.page_etag(f'scan-{scan.id}-{scan.status}',
+                                   *[report_etag(r) for r in stamps], Counter.Get(Counter.SIDEBAR))
+        if httpcache.not_modified(etag):
+            return httpcache.conditional(etag, None, None)
+
+    # the raw reports are downloaded, not put in the page
+    raw_reports = scan.reports.select(Report.id).where(Report.is_raw == True).order_by(Report.id)
+    build = lambda: render("scan.html",
+                           scan=scan,
+                           exec_fields=exec_fields,
+                           raw_reports=list(raw_reports))
+    if etag is None:
+        return build()
+    return httpcache.conditional(etag, None, build)
 
 
 @app.route('/addsite/', methods=['GET', 'POST'])
@@ -196,29 +279,26 @@ def update(scanner: str):
 
 @app.route('/create/', methods=('GET', 'POST'))
 def create():
+    """ the batch of the tasks' lines, or of an uploaded csv/ndjson file of them (see submit) """
     if request.method == 'POST':
-        b = BatchExec.create(name=request.form['batch'],
-                             author=request.form['from'],
-                             email=request.form['email'],
-                             comments=request.form['comments'])
-        des = []
-        for line in request.form[('tasks')].splitlines():
-            line = line.strip()
-            if line=="": continue
-            if (c:=line.count(","))<3:
-                line += ","*(3-c)
-            repo, commit, path, detector = [x.strip() for x in line.split(",")]
-            if repo=="":
-                continue
-            if detector=="":
-                detector = 'scout'
-            if path=="":
-                path = '.'
-            if commit=="":
-                commit = 'main'
-            de = ScannerExec.create(batch=b, commit=commit, repo=repo, path=path, scanner=detector)
-            des.append(de)
-        execute_batch.send(b.id, [de.id for de in des])
+        upload = request.files.get('upload')
+        try:
+            if upload and upload.filename:
+                rows = submit.parse(submit.read_upload(upload), upload.filename)
+            else:
+                rows = submit.parse(request.form.get('tasks', ''))
+            tasks = submit.validate(rows, ScannerRunner.Get)
+        except submit.SubmitError as err:
+            return render('create.html', errors=err.errors, form=request.form), 400
+        with db.atomic():
+            b = BatchExec.create(name=request.form['batch'],
+                                 author=request.form['from'],
+                                 email=request.form['email'],
+                                 comments=request.form['comments'],
+                                 incremental='incremental' in request.form)
+            ids = ScannerExec.CreateMany(b, tasks)
+        execute_batch.send(b.id, ids)
+        return redirect(url_for('batch', id=b.id))
     return render('create.html')
 
 
@@ -227,12 +307,75 @@ def scans():
     return get_scans()
 
 
+@app.route('/metrics', methods=('GET',))
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/search', endpoint='search')
+def search_page():
+    """ ?q=..: findings and output lines matching it, best first (&kind=findings|output) """
+    query, kind = request.args.get('q', '').strip(), request.args.get('kind', 'findings')
+    hits, error = [], None
+    if query:
+        try:
+            if kind == 'output':
+                hits = search.output(query, request.args.get('limit', type=int), marks=True)
+            else:
+                hits = search.findings(query, request.args.get('limit', type=int), marks=True)
+        except search.SearchError as err:
+            error = str(err)
+    return render('search.html', query=query, kind=kind, hits=hits, error=error,
+                  marked=search.marked)
+
+
+@app.route('/profiles')
+def profiles():
+    """ the slowest profiles captured (see profiling) """
+    return render('profiles.html', profiles=profiling.profiles(request.args.get('limit', 100, type=int)),
+                  enabled=profiling.enabled(), settings=profiling)
+
+
+@app.route('/profiles/<id>')
+def profile(id: str):
+    """ pstats' report of a profile (?sort=cumulative|tottime|ncalls) """
+    try:
+        info = profiling.get(id)
+    except (KeyError, OSError):
+        abort(404)
+    sort = request.args.get('sort', 'cumulative')
+    return Response(f"{info['detail'] or info['name']}: {info['duration']:.3f}s\n\n"
+                    + profiling.stats(id, sort), mimetype='text/plain')
+
+
+@app.route('/profiles/<id>/download')
+def profile_download(id: str):
+    try:
+        path = profiling.prof_path(id)
+    except KeyError:
+        abort(404)
+    if not os.path.exists(path):
+        abort(404)
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=id + '.prof')
+
+
 @app.route('/rebuild_reports', methods=('GET',))
 def rebuild_reports():
-    for scan in ScannerExec.select():
-        scanner = ScannerRunner.FromId(scan.id)
-        scanner.rebuild()
-    return redirect('/')
+    """ rebuild stale reports in the background (?all=1: every report) """
+    job = RebuildJob.create(force=request.args.get('all') == '1')
+    rebuild_reports_task.send(job.id)
+    return redirect(url_for('rebuild_job', id=job.id))
+
+
+@app.route('/rebuild_reports/<id>')
+def rebuild_job(id: int):
+    return render('rebuild.html', job=RebuildJob.get_by_id(id))
+
+
+@app.route('/rebuild_reports/<id>/status')
+def rebuild_job_status(id: int):
+    return RebuildJob.get_by_id(id).as_dict()
 
 
 # @dramatiq.actor
@@ -261,4 +404,4 @@ def testme():
 
 if __name__ == '__main__':
     # testme() # app.run()
-    app.run(host=os.environ.get('LISTEN_IP', '127.0.0.1'))
+    create_app().run(host=os.environ.get('LISTEN_IP', '127.0.0.1'))
@@ -0,0 +1,16 @@
+"""
+Benchmarks of the report processing and rendering hot paths, on synthetic
+scout reports (see reports) of 10 to 100k findings. Baselines are json
+files, compare them to catch regressions (see __main__).
+"""
+import os
+import subprocess
+
+
+def git_revision():
+    """ of the tree benchmarked, for the baselines """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
@@ -0,0 +1,100 @@
+"""
+    python -m bench run [--sizes 10,1000,100000] [--repeat 5] [--only to_json,..] [-o baseline.json]
+    python -m bench compare base.json new.json [--threshold 0.25] [--min-delta 0.001]
+    python -m bench report --findings 1000 [--version 0.2.15] > report.json
+    python -m bench output [--concurrency 1,4] [--lines 20000] [--size 100] [--rate 0] [-o output.json]
+    python -m bench e2e [--scans 200] [--repos 20] [--findings 5-50] [--delay 0.5-2] [--fail 0.05] [--threads 8]
+                        [--redis localhost] [-o e2e.json]
+
+run in web/. compare exits with 1 if there are regressions.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+
+def _ints(value: str):
+    return [int(v) for v in value.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='drunner benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='time the benchmarks, write a baseline')
+    run.add_argument('--sizes', type=_ints, default=None, help='findings, ie: 10,1000,100000')
+    run.add_argument('--repeat', type=int, default=5, help='runs of each benchmark (at most)')
+    run.add_argument('--budget', type=float, default=10.0, help='seconds per benchmark (about)')
+    run.add_argument('--only', type=lambda v: v.split(','), default=None,
+                     help='benchmarks whose names contain any of these')
+    run.add_argument('-o', '--output', help='baseline file (json), stdout by default')
+    cmp = commands.add_parser('compare', help='flag regressions between two baselines')
+    cmp.add_argument('base')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=None, help='relative slowdown, 0.25: 25%%')
+    cmp.add_argument('--min-delta', type=float, default=None, help='absolute slowdown, seconds')
+    report = commands.add_parser('report', help='write a synthetic scout raw report')
+    report.add_argument('--findings', type=int, default=1000)
+    report.add_argument('--version', default=None, help='scout version, its format')
+    report.add_argument('--noise', type=int, default=200, help='lines without findings')
+    output = commands.add_parser('output', help='time worker.exec capturing a chatty command\'s output')
+    output.add_argument('--concurrency', type=_ints, default=[1, 4], help='executions at once, ie: 1,4,8')
+    output.add_argument('--lines', type=int, default=20000, help='printed by each execution')
+    output.add_argument('--size', type=int, default=100, help='bytes per line')
+    output.add_argument('--rate', type=float, default=0, help='lines/s of each execution, 0: no limit')
+    output.add_argument('--stderr', type=float, default=0.1, help='fraction of the lines on stderr')
+    output.add_argument('--no-latency', action='store_true', help='don\'t sample the latency (polling the db)')
+    output.add_argument('-o', '--output', help='results file (json), stdout by default')
+    e2e = commands.add_parser('e2e', help='run batches of scans offline: local repos and a fake docker')
+    e2e.add_argument('--scans', type=int, default=200, help='scans in the batch')
+    e2e.add_argument('--repos', type=int, default=20, help='local git repos they scan')
+    e2e.add_argument('--findings', default='10', help='findings per report: n or min-max')
+    e2e.add_argument('--delay', default='0', help='seconds per scan (in docker): s or min-max')
+    e2e.add_argument('--fail', type=float, default=0.0, help='fraction of the scans that fail')
+    e2e.add_argument('--threads', type=int, default=8, help='worker threads')
+    e2e.add_argument('--redis', default=None, help='redis host (its queues are flushed), a StubBroker by default')
+    e2e.add_argument('--timeout', type=float, default=3600.0, help='seconds to wait for the batch')
+    e2e.add_argument('-o', '--output', help='results file (json), stdout by default')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        from bench.compare import compare, regressions, format_rows, DEFAULT_THRESHOLD, DEFAULT_MIN_DELTA
+        with open(args.base) as base, open(args.new) as new:
+            rows = compare(json.load(base), json.load(new),
+                           DEFAULT_THRESHOLD if args.threshold is None else args.threshold,
+                           DEFAULT_MIN_DELTA if args.min_delta is None else args.min_delta)
+        print(format_rows(rows))
+        return 1 if regressions(rows) else 0
+
+    if args.command == 'report':
+        from bench import reports
+        sys.stdout.buffer.write(reports.raw_report(args.findings, args.version or reports.V0216, args.noise))
+        return 0
+
+    # a scratch db unless one is given, before model is imported
+    with tempfile.TemporaryDirectory(prefix='drunner-bench') as tmp:
+        os.environ.setdefault('DB', os.path.join(tmp, 'bench.sqlite.db'))
+        log = lambda line: print(line, file=sys.stderr)
+        if args.command == 'e2e':
+            from bench import e2e
+            baseline = e2e.run(args.scans, args.repos, args.findings, args.delay, args.fail, args.threads,
+                               args.redis, args.timeout, log=log)
+        elif args.command == 'output':
+            from bench import output
+            baseline = output.run(args.concurrency, args.lines, args.size, args.rate, args.stderr,
+                                  not args.no_latency, log=log)
+        else:
+            from bench import suite
+            baseline = suite.run(args.sizes or suite.DEFAULT_SIZES, args.repeat, args.budget, args.only,
+                                 log=log)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(baseline, output, indent=2)
+    else:
+        json.dump(baseline, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
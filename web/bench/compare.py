@@ -0,0 +1,31 @@
+"""
+Two baselines side by side: a benchmark is a regression when its median got
+slower than threshold (relative) and min_delta (seconds) at once, so tiny
+timings' noise isn't reported.
+"""
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_MIN_DELTA = 0.001
+
+
+def compare(base: dict, new: dict, threshold=DEFAULT_THRESHOLD, min_delta=DEFAULT_MIN_DELTA) -> list:
+    """ (name, base median, new median, ratio, regressed) of the benchmarks in both """
+    rows = []
+    for name, timings in new['results'].items():
+        if name not in base['results']:
+            continue
+        old, now = base['results'][name]['median'], timings['median']
+        ratio = now / old if old else float('inf')
+        rows.append((name, old, now, ratio, ratio > 1 + threshold and now - old > min_delta))
+    return rows
+
+
+def regressions(rows) -> list:
+    return [row for row in rows if row[4]]
+
+
+def format_rows(rows) -> str:
+    lines = [f'{"benchmark":40} {"base":>12} {"new":>12} {"ratio":>7}']
+    for name, old, now, ratio, regressed in rows:
+        lines.append(f'{name:40} {old*1000:10.2f}ms {now*1000:10.2f}ms {ratio:7.2f}'
+                     + ('  REGRESSION' if regressed else ''))
+    return '\n'.join(lines)
@@ -0,0 +1,184 @@
+"""
+End to end load test, offline: batches of scans of local (file://) git
+repos, run by the real actors (execute_batch, execute_task and the stages)
+on a StubBroker (or a local redis) with a fake `docker` (bench/fake_docker.py)
+on PATH. Reports scans/minute and the latency of each stage (StageTiming).
+
+Import it with DB pointing to a scratch db file (see bench.__main__).
+"""
+import datetime
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import dramatiq
+from dramatiq.brokers.stub import StubBroker
+from dramatiq.middleware import Prometheus, default_middleware
+
+import drunner
+import model
+from bench import git_revision, reports
+
+FAKE_DOCKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_docker.py')
+# how often the batch's summary is checked
+POLL_INTERVAL = 0.5
+
+
+def _middleware() -> list:
+    # the Prometheus middleware is only set up in `dramatiq` worker processes
+    return [middleware() for middleware in default_middleware if middleware is not Prometheus]
+
+
+def make_repos(root: str, count: int, contracts: int = 3) -> list:
+    """ file:// urls of count git repos with a main branch of contracts crates """
+    env = dict(os.environ, GIT_AUTHOR_NAME='bench', GIT_AUTHOR_EMAIL='bench@localhost',
+               GIT_COMMITTER_NAME='bench', GIT_COMMITTER_EMAIL='bench@localhost')
+    urls = []
+    for idx in range(count):
+        repo = os.path.join(root, f'repo{idx}')
+        for contract in range(contracts):
+            src = os.path.join(repo, f'contract{contract}', 'src')
+            os.makedirs(src)
+            with open(os.path.join(repo, f'contract{contract}', 'Cargo.toml'), 'w') as f:
+                f.write(f'[package]\nname = "contract{contract}"\nversion = "0.1.0"\n')
+            with open(os.path.join(src, 'lib.rs'), 'w') as f:
+                f.write(f'pub fn value() -> u32 {{ {idx} }}\n')
+        for cmd in (['git', 'init', '-q', '-b', 'main'], ['git', 'add', '.'],
+                    ['git', 'commit', '-q', '-m', 'contracts']):
+            subprocess.run(cmd, cwd=repo, env=env, check=True)
+        urls.append(f'file://{repo}')
+    return urls
+
+
+@contextmanager
+def fake_docker(root: str, **settings):
+    """ `docker` on PATH is fake_docker.py, with its FAKE_DOCKER_<SETTING>s """
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    docker = os.path.join(bin_dir, 'docker')
+    with open(docker, 'w') as f:
+        f.write(f'#!/bin/sh\nexec {sys.executable} {FAKE_DOCKER} "$@"\n')
+    os.chmod(docker, os.stat(docker).st_mode | stat.S_IEXEC)
+    saved = dict(os.environ)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+    os.environ.update({f'FAKE_DOCKER_{name.upper()}': str(value) for name, value in settings.items()
+                       if value is not None})
+    try:
+        yield docker
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def submit(repos: list, scans: int, contracts: int = 3) -> model.BatchExec:
+    """ a batch of scans over repos' contracts, sent to execute_batch """
+    batch = model.BatchExec.create(name=f'e2e-{scans}', author='bench')
+    tasks = [{'repo': repos[idx % len(repos)], 'commit': 'main',
+              'path': f'contract{(idx // len(repos)) % contracts}', 'scanner': 'scout'}
+             for idx in range(scans)]
+    ids = model.ScannerExec.CreateMany(batch, tasks)
+    drunner.execute_batch.send(batch.id, ids)
+    return batch
+
+
+def wait_batch(batch_id: int, timeout: float, log=print) -> model.BatchSummary:
+    deadline = time.monotonic() + timeout
+    last = None
+    while True:
+        summary = model.BatchSummary.Get(batch_id)
+        progress = (summary.done, summary.failed, summary.running, summary.queued)
+        if progress != last:
+            log(f'  done {summary.done} failed {summary.failed} running {summary.running} '
+                f'queued {summary.queued}')
+            last = progress
+        if summary.finished or time.monotonic() > deadline:
+            return summary
+        time.sleep(POLL_INTERVAL)
+
+
+def _percentile(values: list, fraction: float):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def stage_latencies(batch_id: int) -> dict:
+    """ stage -> count and p50/p90/p99/max seconds of the batch's StageTimings """
+    durations = {}
+    query = (model.StageTiming.select(model.StageTiming.stage, model.StageTiming.duration)
+             .join(model.ScannerExec)
+             .where(model.ScannerExec.batch == batch_id)
+             .tuples())
+    for stage, duration in query:
+        durations.setdefault(stage, []).append(duration)
+    return {stage: {'count': len(values),
+                    'p50': _percentile(sorted(values), 0.5),
+                    'p90': _percentile(sorted(values), 0.9),
+                    'p99': _percentile(sorted(values), 0.99),
+                    'max': max(values)}
+            for stage, values in sorted(durations.items())}
+
+
+def run(scans=200, repos=20, findings='10', delay='0', fail=0.0, threads=8, redis=None,
+        timeout=3600.0, log=print) -> dict:
+    """ runs a batch of scans through the actors and returns its results (see suite.run) """
+    if drunner.DOCKER_BACKEND != 'cli':
+        raise RuntimeError('the load test fakes the docker cli, run it with DOCKER_BACKEND=cli')
+    root = tempfile.mkdtemp(prefix='drunner-e2e-')
+    work_dir = drunner.WORK_DIR
+    try:
+        drunner.WORK_DIR = os.path.join(root, 'work')
+        started = time.perf_counter()
+        urls = make_repos(os.path.join(root, 'repos'), repos)
+        log(f'{repos} repos: {time.perf_counter() - started:.2f}s')
+        if redis:
+            from dramatiq.brokers.redis import RedisBroker
+            broker = drunner.setup_broker(RedisBroker(host=redis, middleware=_middleware()))
+            broker.flush_all()
+        else:
+            broker = drunner.setup_broker(StubBroker(middleware=_middleware()))
+        with fake_docker(root, findings=findings, delay=delay, fail=fail, version=reports.V0216):
+            worker = dramatiq.Worker(broker, worker_threads=threads, worker_timeout=100)
+            worker.start()
+            try:
+                started = time.perf_counter()
+                batch = submit(urls, scans)
+                summary = wait_batch(batch.id, timeout, log)
+                elapsed = time.perf_counter() - started
+            finally:
+                worker.stop()
+    finally:
+        drunner.setup_broker(drunner.declaring_broker)
+        drunner.WORK_DIR = work_dir
+        shutil.rmtree(root, ignore_errors=True)
+    finished = summary.done + summary.failed + summary.cancelled
+    result = {
+        'median': elapsed,
+        'min': elapsed,
+        'runs': 1,
+        'scans': scans,
+        'done': summary.done,
+        'failed': summary.failed,
+        'unfinished': scans - finished,
+        'findings': summary.findings,
+        'scans_per_min': finished / elapsed * 60,
+        'stages': stage_latencies(batch.id),
+    }
+    log(f'{finished} scans in {elapsed:.1f}s: {result["scans_per_min"]:.0f} scans/min, '
+        f'{summary.failed} failed, {result["unfinished"]} unfinished')
+    log(f'{"stage":16} {"count":>6} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9}')
+    for stage, timing in result['stages'].items():
+        log(f'{stage:16} {timing["count"]:6} ' +
+            ' '.join(f'{timing[p]*1000:7.0f}ms' for p in ('p50', 'p90', 'p99', 'max')))
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'scans': scans, 'repos': repos, 'findings': findings, 'delay': delay, 'fail': fail,
+            'threads': threads, 'broker': f'redis:{redis}' if redis else 'stub',
+        },
+        'results': {f'e2e[x{threads}]/{scans}': result},
+    }
@@ -0,0 +1,35 @@
+"""
+A chatty command for the output capture benchmark: prints lines of about
+--size bytes at --rate lines/s (0: as fast as it can) to stdout, and a
+--stderr fraction of them to stderr.
+
+Every line starts with its number and the time it was printed at:
+`<n> <time.time()> xxxx..`
+"""
+import argparse
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=100)
+    parser.add_argument('--rate', type=float, default=0)
+    parser.add_argument('--stderr', type=float, default=0.1)
+    args = parser.parse_args(argv)
+    every = round(1 / args.stderr) if args.stderr else 0
+    started = time.time()
+    for n in range(args.lines):
+        if args.rate:
+            delay = started + n / args.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        head = f'{n} {time.time():.6f} '
+        out = sys.stderr if every and n % every == every - 1 else sys.stdout
+        out.write(head + 'x' * max(0, args.size - len(head)) + '\n')
+        out.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+A `docker` stand-in for the load test (see e2e): `docker run` of the scout
+image answers `--version`, or writes a synthetic raw report (bench.reports)
+where scout would have, after a delay. Every other command succeeds doing
+nothing.
+
+Set up by environment:
+    FAKE_DOCKER_VERSION   scout version, its report format (0.2.16)
+    FAKE_DOCKER_FINDINGS  findings per report: n or min-max (10)
+    FAKE_DOCKER_DELAY     seconds per scan: s or min-max (0)
+    FAKE_DOCKER_LINES     output lines printed while "scanning" (20)
+    FAKE_DOCKER_FAIL      fraction of the scans that fail (0)
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench import reports  # noqa: E402
+
+
+def _range(value: str, convert=float):
+    low, _, high = value.partition('-')
+    return convert(low), convert(high or low)
+
+
+def _run_args(args):
+    """ (env, volumes) of `docker run` arguments """
+    env, volumes = {}, {}
+    args = iter(args)
+    for arg in args:
+        if arg == '-e':
+            key, _, value = next(args).partition('=')
+            env[key] = value
+        elif arg == '-v':
+            host, _, bind = next(args).partition(':')
+            volumes[bind] = host
+        elif arg == '--name':
+            next(args)
+    return env, volumes
+
+
+def _host_path(path: str, volumes: dict) -> str:
+    for bind, host in volumes.items():
+        if path.startswith(bind.rstrip('/') + '/'):
+            return host + path[len(bind.rstrip('/')):]
+    raise SystemExit(f'fake docker: {path} is not in a volume')
+
+
+def run(args) -> int:
+    env, volumes = _run_args(args)
+    version = os.environ.get('FAKE_DOCKER_VERSION', reports.V0216)
+    scout_args = env.get('INPUT_SCOUT_ARGS', '').split()
+    if '--version' in scout_args:
+        print(reports.scanner_version(version))
+        return 0
+    delay = random.uniform(*_range(os.environ.get('FAKE_DOCKER_DELAY', '0')))
+    lines = int(os.environ.get('FAKE_DOCKER_LINES', 20))
+    for n in range(lines):
+        print(f'    Checking contract{n} v0.1.0 ({env.get("INPUT_TARGET", "")})', flush=True)
+        time.sleep(delay / max(lines, 1))
+    if lines == 0:
+        time.sleep(delay)
+    if random.random() < float(os.environ.get('FAKE_DOCKER_FAIL', 0)):
+        print('error: could not compile (fake failure)', file=sys.stderr)
+        return 101
+    if '--output-path' in scout_args:
+        output = _host_path(scout_args[scout_args.index('--output-path') + 1], volumes)
+    else:
+        output = _host_path(env['OUTPUT_NAME'], volumes)
+    findings = random.randint(*_range(os.environ.get('FAKE_DOCKER_FINDINGS', '10'), int))
+    with open(output, 'wb') as report:
+        report.write(reports.raw_report(findings, version, noise=20))
+    return 0
+
+
+def main(argv) -> int:
+    if argv[:1] == ['run']:
+        return run(argv[1:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
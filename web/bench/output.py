@@ -0,0 +1,156 @@
+"""
+Output capture throughput: worker.exec running bench/emit.py, concurrently
+or not, measuring
+
+ * lines/s: lines persisted over the wall time of the executions
+ * latency: from a line being printed to it being queryable (OutputLine),
+   sampled by polling the db
+ * cpu: seconds used by worker's reader (savelines) and writer (db_save) threads
+ * db growth: db + wal bytes per line
+
+Import it with DB pointing to a scratch db file (see bench.__main__).
+"""
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import model
+import worker
+from bench import git_revision
+
+EMIT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'emit.py')
+# how often the latency sampler looks for new lines (seconds)
+POLL_INTERVAL = 0.01
+
+_emitted = re.compile(r'(\d+) (\d+\.\d+) ')
+
+
+@contextmanager
+def thread_cpu():
+    """ cpu seconds of worker's reader and writer threads started meanwhile, by role """
+    used, lock = defaultdict(float), threading.Lock()
+    originals = worker.savelines, worker.db_save
+
+    def timed(role, func):
+        def run(*args):
+            try:
+                return func(*args)
+            finally:
+                with lock:
+                    used[role] += time.thread_time()
+        return run
+    worker.savelines, worker.db_save = timed('reader', originals[0]), timed('writer', originals[1])
+    try:
+        yield used
+    finally:
+        worker.savelines, worker.db_save = originals
+
+
+def db_size() -> int:
+    return sum(os.path.getsize(model.DB_FILE + suffix)
+               for suffix in ('', '-wal') if os.path.exists(model.DB_FILE + suffix))
+
+
+def _text(line) -> str:
+    return line.decode(errors='replace') if isinstance(line, bytes) else str(line)
+
+
+class LatencySampler(threading.Thread):
+    """ polls the OutputLines newer than the ones there were, noting when each was seen """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.last_id = model.OutputLine.select(model.fn.MAX(model.OutputLine.id)).scalar() or 0
+        self.latencies = []
+        self.stopping = threading.Event()
+
+    def poll(self):
+        rows = (model.OutputLine.select(model.OutputLine.id, model.OutputLine.line)
+                .where(model.OutputLine.id > self.last_id).order_by(model.OutputLine.id).tuples())
+        seen = time.time()
+        for id, line in rows:
+            self.last_id = id
+            match = _emitted.match(_text(line))
+            if match:
+                self.latencies.append(seen - float(match.group(2)))
+
+    def run(self):
+        with model.db.connection_context():
+            while not self.stopping.wait(POLL_INTERVAL):
+                self.poll()
+            self.poll()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_once(concurrency: int, lines: int, size: int, rate: float, stderr: float, latency=True) -> dict:
+    """ concurrency executions of lines lines each, at the same time """
+    cmd = f'{sys.executable} {EMIT} --lines {lines} --size {size} --rate {rate} --stderr {stderr}'
+    size_before = db_size()
+    sampler = LatencySampler() if latency else None
+
+    def execute(n):
+        with model.db.connection_context():
+            return worker.exec('bench-output', [cmd]).id
+    with thread_cpu() as cpu:
+        if sampler:
+            sampler.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            ids = list(pool.map(execute, range(concurrency)))
+        elapsed = time.perf_counter() - started
+        if sampler:
+            sampler.stop()
+    persisted = (model.OutputLine.select().where(model.OutputLine.execution.in_(ids)).count())
+    latencies = sampler.latencies if sampler else []
+    return {
+        'median': elapsed,
+        'min': elapsed,
+        'runs': 1,
+        'lines': persisted,
+        'lost': concurrency * lines - persisted,
+        'lines_per_s': persisted / elapsed,
+        'latency_p50': _percentile(latencies, 0.5),
+        'latency_p99': _percentile(latencies, 0.99),
+        'latency_max': max(latencies) if latencies else None,
+        'cpu_reader': cpu['reader'],
+        'cpu_writer': cpu['writer'],
+        'cpu_per_1k_lines': (cpu['reader'] + cpu['writer']) / persisted * 1000 if persisted else None,
+        'db_bytes_per_line': (db_size() - size_before) / persisted if persisted else None,
+    }
+
+
+def run(concurrency=(1, 4), lines=20000, size=100, rate=0.0, stderr=0.1, latency=True,
+        log=print) -> dict:
+    """ a baseline (see suite.run) of run_once at each concurrency """
+    results = {}
+    for n in concurrency:
+        key = f'output[x{n}]/{lines}'
+        results[key] = result = run_once(n, lines, size, rate, stderr, latency)
+        log(f'{key:24} {result["lines_per_s"]:10.0f} lines/s'
+            f'  p50 {(result["latency_p50"] or 0)*1000:8.1f}ms  p99 {(result["latency_p99"] or 0)*1000:8.1f}ms'
+            f'  cpu r/w {result["cpu_reader"]:.2f}/{result["cpu_writer"]:.2f}s'
+            f'  {result["db_bytes_per_line"] or 0:.0f}B/line  lost {result["lost"]}')
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'lines': lines, 'size': size, 'rate': rate, 'stderr': stderr,
+            'concurrency': list(concurrency),
+        },
+        'results': results,
+    }
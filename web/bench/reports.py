@@ -0,0 +1,92 @@
+"""
+Synthetic scout raw reports: a report is the cargo json lines scout writes,
+some build noise (artifacts) and a diagnostic line per finding.
+"""
+import itertools
+import json
+
+# the formats of scout before 0.2.16 and since then, as ScoutRunner tells them apart
+PRE_0216 = '0.2.15'
+V0216 = '0.2.16'
+VERSIONS = (PRE_0216, V0216)
+
+CODES = ('unsafe-unwrap', 'unsafe-expect', 'divide-before-multiply', 'overflow-check',
+         'set-contract-storage', 'unused-return-enum', 'avoid-panic-error', 'dos-unbounded-operation')
+LEVELS = ('High', 'Medium', 'Low', 'Enhancement', 'warning')
+CRATES = 64
+
+
+def _span(idx: int) -> dict:
+    line = 10 + idx % 500
+    source = f'    let value{idx} = storage.get(&key).unwrap();'
+    return {
+        'byte_start': line * 40, 'byte_end': line * 40 + 30,
+        'column_start': 17, 'column_end': 47,
+        'line_start': line, 'line_end': line,
+        'file_name': f'src/module{idx % 20}/lib.rs',
+        'is_primary': True, 'label': None, 'expansion': None,
+        'suggested_replacement': None, 'suggestion_applicability': None,
+        'text': [{'text': source, 'highlight_start': 17, 'highlight_end': 47}],
+    }
+
+
+def _diagnostic(idx: int) -> dict:
+    code = CODES[idx % len(CODES)]
+    message = f'{code.replace("-", " ")} may panic or misbehave here (#{idx})'
+    return {
+        'message': message,
+        'code': {'code': code, 'explanation': None},
+        'level': LEVELS[idx % len(LEVELS)],
+        'spans': [_span(idx)],
+        'children': [],
+        'rendered': f'warning: {message}\n  --> src/lib.rs\n',
+    }
+
+
+def _crate(idx: int) -> str:
+    return f'contract{idx % CRATES}'
+
+
+def finding_line(idx: int, version: str = V0216) -> str:
+    diagnostic = _diagnostic(idx)
+    if version == PRE_0216:
+        return json.dumps({
+            'reason': 'compiler-message',
+            'package_id': f'{_crate(idx)} 0.1.0 (path+file:///scoutme/srcs/{_crate(idx)})',
+            'manifest_path': f'/scoutme/srcs/{_crate(idx)}/Cargo.toml',
+            'target': {'kind': ['cdylib'], 'name': _crate(idx), 'src_path': '/scoutme/srcs/src/lib.rs'},
+            'message': diagnostic,
+        })
+    return json.dumps(dict({'$message_type': 'diagnostic'}, crate=_crate(idx), **diagnostic))
+
+
+def noise_line(idx: int, version: str = V0216) -> str:
+    """ a line without findings, as most of the lines of a report """
+    package = f'dependency{idx} 1.0.{idx} (registry+https://github.com/rust-lang/crates.io-index)'
+    if version == PRE_0216:
+        return json.dumps({
+            'reason': 'compiler-artifact', 'package_id': package,
+            'manifest_path': f'/usr/local/cargo/registry/src/dependency{idx}/Cargo.toml',
+            'target': {'kind': ['lib'], 'crate_types': ['lib'], 'name': f'dependency{idx}'},
+            'profile': {'opt_level': '0', 'debuginfo': 2}, 'features': ['default', 'std'],
+            'filenames': [f'/tmp/debug/deps/libdependency{idx}.rlib'], 'fresh': False,
+        })
+    return json.dumps({'$message_type': 'artifact', 'package_id': package,
+                       'filenames': [f'/tmp/debug/deps/libdependency{idx}.rlib'], 'fresh': False})
+
+
+def lines(findings: int, version: str = V0216, noise: int = 200):
+    """ the lines of a report with that many findings after noise build lines """
+    for idx in range(noise):
+        yield noise_line(idx, version)
+    for idx in range(findings):
+        yield finding_line(idx, version)
+
+
+def raw_report(findings: int, version: str = V0216, noise: int = 200) -> bytes:
+    return '\n'.join(itertools.chain(lines(findings, version, noise), [''])).encode()
+
+
+def scanner_version(version: str) -> str:
+    """ what `scout --version` prints, ScannerExec.scanner_version """
+    return f'cargo-scout-audit {version}'
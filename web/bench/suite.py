@@ -0,0 +1,118 @@
+"""
+The benchmarks: report processing (parse, serialise, stats) and the batch
+level views (composite report, csv export, batch page), each at every size
+(number of findings).
+
+Import it with DB pointing to a scratch db file (see bench.__main__), the
+batches it creates are left there.
+"""
+import datetime
+import math
+import platform
+import statistics
+import time
+
+import drunner
+import model
+from app import get_app
+from bench import git_revision, reports
+
+DEFAULT_SIZES = (10, 1000, 100000)
+# findings per scan of the benchmarked batches
+FINDINGS_PER_SCAN = 100
+
+
+def measure(func, repeat: int, budget: float) -> dict:
+    """ timings of up to repeat calls of func, fewer if they take more than budget seconds """
+    times = []
+    started = time.perf_counter()
+    while len(times) < repeat:
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+        if time.perf_counter() - started > budget:
+            break
+    return {'min': min(times), 'median': statistics.median(times), 'runs': len(times)}
+
+
+def scout_runner(version: str):
+    scan = model.ScannerExec(repo='file:///bench', commit='main', path='.', scanner='scout',
+                             scanner_version=reports.scanner_version(version))
+    return drunner.ScannerRunner.Get('scout')(scan)
+
+
+def make_batch(size: int, version: str = reports.V0216) -> model.BatchExec:
+    """ a batch of finished scans with size findings, FINDINGS_PER_SCAN each """
+    batch = model.BatchExec.create(name=f'bench-{size}')
+    per_scan = min(size, FINDINGS_PER_SCAN)
+    report = scout_runner(version).process_report(reports.raw_report(per_scan, version))
+    content, findings = report.to_json(), [f.as_dict() for f in report.findings]
+    for idx in range(math.ceil(size / per_scan)):
+        scan = model.ScannerExec.create(batch=batch, repo=f'file:///bench/repo{idx}', commit='main',
+                                        path='.', scanner='scout',
+                                        scanner_version=reports.scanner_version(version),
+                                        status=model.ScanStatus.Done)
+        count = min(per_scan, size - idx * per_scan)
+        drunner.ScannerRunner.GetForExec(scan).save_report(content, findings[:count])
+    return batch
+
+
+def report_benchmarks(size: int) -> dict:
+    """ name -> function to time """
+    benchmarks = {}
+    for version in reports.VERSIONS:
+        raw = reports.raw_report(size, version)
+        runner = scout_runner(version)
+        benchmarks[f'process_report[{version}]'] = lambda runner=runner, raw=raw: runner.process_report(raw)
+    report = scout_runner(reports.V0216).process_report(reports.raw_report(size))
+    content = report.to_json()
+    benchmarks['to_json'] = report.to_json
+    # a new Report each time, its parsed content is cached
+    benchmarks['vulnstats'] = lambda: model.Report(content=content, is_raw=False).vulnstats
+    return benchmarks
+
+
+def batch_benchmarks(size: int) -> dict:
+    batch = make_batch(size)
+    client = get_app().test_client()
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        return response.get_data()
+    # stored once, so that [cached] measures the cache hits only
+    batch.composite_report()
+    return {
+        'composite_report': batch.build_composite_report,
+        'composite_report[cached]': batch.composite_report,
+        'composite_csv': lambda: get(f'/batch/{batch.id}/composite'),
+        'batch_page': lambda: get(f'/batch/{batch.id}'),
+    }
+
+
+def run(sizes=DEFAULT_SIZES, repeat=5, budget=10.0, only=None, log=print) -> dict:
+    """ the baseline: results are name/size -> timings (seconds), see measure() """
+    results = {}
+    for size in sizes:
+        for setup in (report_benchmarks, batch_benchmarks):
+            started = time.perf_counter()
+            benchmarks = {name: func for name, func in setup(size).items()
+                          if only is None or any(o in name for o in only)}
+            if benchmarks:
+                log(f'{setup.__name__}({size}) setup: {time.perf_counter() - started:.2f}s')
+            for name, func in benchmarks.items():
+                key = f'{name}/{size}'
+                results[key] = measure(func, repeat, budget)
+                log(f'{key:40} {results[key]["median"]*1000:12.2f}ms  ({results[key]["runs"]} runs)')
+    return {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
@@ -0,0 +1,13 @@
+"""
+Set up of the processes that only read the db for their parent, ie: the
+report parsing pool of a rebuild. The parent upgraded the db already, the
+children must not write to it while they import model (see model.upgrade).
+
+Imports nothing of drunner's: a pool's initializer runs before its tasks'
+modules are imported.
+"""
+import os
+
+
+def no_upgrade():
+    os.environ['DB_UPGRADE'] = 'false'
@@ -0,0 +1,181 @@
+"""
+Runner backend talking to the docker daemon through its API (DOCKER_BACKEND=api)
+instead of running the `docker` client in a shell.
+
+Output goes to the same OutputLine storage worker.exec uses and the
+container's cpu time and peak memory are recorded on the Execution.
+"""
+import datetime
+import signal
+import sys
+import threading
+from queue import Queue
+
+import worker
+from model import Execution
+
+try:
+    import docker
+    from requests.exceptions import ReadTimeout, ConnectionError as RequestsConnectionError
+except ImportError:
+    docker = None
+
+
+_client = None
+
+
+def client():
+    global _client
+    if docker is None:
+        raise RuntimeError('DOCKER_BACKEND=api requires the docker package (pip install docker).')
+    if _client is None:
+        _client = docker.from_env()
+    return _client
+
+
+class LineStream:
+    """ readline() over the chunks of a docker log stream, for worker.savelines """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def readline(self):
+        while b'\n' not in self.buffer:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                line, self.buffer = self.buffer, b''
+                return line
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line + b'\n'
+
+
+def collect_stats(container, stats: dict):
+    """ keeps the container's cpu seconds and peak memory until it goes away """
+    try:
+        for sample in container.stats(stream=True, decode=True):
+            memory = sample.get('memory_stats') or {}
+            usage = memory.get('max_usage') or memory.get('usage')
+            if usage:
+                stats['mem_peak'] = max(stats.get('mem_peak', 0), usage)
+            cpu = ((sample.get('cpu_stats') or {}).get('cpu_usage') or {}).get('total_usage')
+            if cpu:
+                stats['cpu_seconds'] = cpu / 1e9
+    except Exception:
+        pass  # container removed
+
+
+def wait(container, timeout=None, cancelled=None):
+    """ as worker.wait, returns (exit code, None) or (None, why it must be killed) """
+    deadline = None if timeout is None else datetime.datetime.now().timestamp() + timeout
+    while True:
+        try:
+            return container.wait(timeout=worker.POLL_INTERVAL)['StatusCode'], None
+        except (ReadTimeout, RequestsConnectionError):
+            pass
+        if deadline is not None and datetime.datetime.now().timestamp() > deadline:
+            return None, Execution.KILLED_TIMEOUT
+        if cancelled is not None and cancelled():
+            return None, Execution.KILLED_CANCELLED
+
+
+def _error(ex, q, err):
+    print(f"Error while running: {err}", file=sys.stderr)
+    q.put([(ex, False, 0, str(err))])
+
+
+def _start(ex: Execution):
+    ex.timestamp = datetime.datetime.now()
+    ex.save()
+    q = Queue()
+    thread = threading.Thread(target=worker.db_save, args=(q,))
+    thread.start()
+    return q, thread
+
+
+def _end(ex: Execution, q, thread, ret):
+    q.put(None)
+    thread.join()
+    ex.set_end(ret)
+    try:
+        ex.save()
+    except Exception as err:
+        print(f"Failed to save: {err}", file=sys.stderr)
+    return Execution.get_by_id(ex.id)
+
+
+def run(ex: Execution, image, environment=None, volumes=None, name=None,
+        timeout=None, cancelled=None) -> Execution:
+    """ docker run --rm, with the container's output stored as ex's output """
+    q, thread = _start(ex)
+    container, ret, stats, stats_thread = None, None, {}, None
+    try:
+        container = client().containers.run(image, environment=environment, volumes=volumes,
+                                            name=name, detach=True)
+        stats_thread = threading.Thread(target=collect_stats, args=(container, stats), daemon=True)
+        stats_thread.start()
+        stdout = LineStream(container.logs(stdout=True, stderr=False, stream=True, follow=True))
+        stderr = LineStream(container.logs(stdout=False, stderr=True, stream=True, follow=True))
+        with worker.launch_thread(ex, stdout, True, q):
+            with worker.launch_thread(ex, stderr, False, q):
+                try:
+                    ret, ex.killed = wait(container, timeout, cancelled)
+                except BaseException:
+                    ex.killed = Execution.KILLED_INTERRUPTED
+                    raise
+                finally:
+                    if ex.killed is not None:
+                        kill(container)
+                        ret = -signal.SIGKILL
+    except Exception as err:
+        _error(ex, q, err)
+    finally:
+        if container is not None:
+            try:
+                container.remove(force=True)
+            except Exception:
+                pass
+        if stats_thread is not None:
+            stats_thread.join(worker.POLL_INTERVAL)
+        ex.cpu_seconds = stats.get('cpu_seconds')
+        ex.mem_peak = stats.get('mem_peak')
+        ex = _end(ex, q, thread, -1 if ret is None else ret)
+    return ex
+
+
+def _stream(ex: Execution, events, key: str) -> Execution:
+    q, thread = _start(ex)
+    ret, idx = 0, 0
+    try:
+        for event in events:
+            if 'error' in event:
+                ret = 1
+                q.put([(ex, False, idx, event['error'].rstrip())])
+            elif event.get(key) and not event.get('progressDetail'):
+                line = event[key].rstrip()
+                if 'id' in event:
+                    line = f"{event['id']}: {line}"
+                q.put([(ex, True, idx, line)])
+            idx += 1
+    except Exception as err:
+        ret = 1
+        _error(ex, q, err)
+    return _end(ex, q, thread, ret)
+
+
+def pull(ex: Execution, image: str) -> Execution:
+    return _stream(ex, client().api.pull(image, stream=True, decode=True), 'status')
+
+
+def build(ex: Execution, path: str, tag: str) -> Execution:
+    return _stream(ex, client().api.build(path=path, tag=tag, decode=True), 'stream')
+
+
+def kill(container):
+    """ container or its name """
+    try:
+        if isinstance(container, str):
+            container = client().containers.get(container)
+        container.kill()
+    except Exception:
+        pass  # already gone
@@ -1,21 +1,88 @@
+import datetime
+import itertools
 import json
 import logging
+import multiprocessing
 import os
+import shlex
+import shutil
 import tempfile
+import time
 import traceback
 from contextlib import contextmanager
 
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+
 import dramatiq
 from dramatiq.brokers.redis import RedisBroker
+from dramatiq.brokers.stub import StubBroker
+from peewee import JOIN
 
 import worker
 import model
+import dbchild
+import dockerapi
+import profiling
 from results import ResultsReport, Finding, Priority, Scanner
-from errors import CloneFailed, CheckoutFailed, UnknownScanner
+from errors import CloneFailed, CheckoutFailed, UnknownScanner, StageTimeout, ScanCancelled, BrokerNotSetUp
 
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
-redis_broker = RedisBroker(host=REDIS_HOST)
-dramatiq.set_broker(redis_broker)
+
+
+class DeclaringOnly(dramatiq.Middleware):
+    """ messages sent before setup_broker() would be lost in the declaring broker """
+    ERROR = ('the actors are not bound to a broker yet: setup_broker() binds them '
+             '(gunicorn -c gunicorn.conf.py, dramatiq drunner:setup_broker)')
+
+    def before_enqueue(self, broker, message, delay):
+        raise BrokerNotSetUp(f'{message.actor_name} not sent, {self.ERROR}')
+
+    def before_worker_boot(self, broker, worker):
+        raise BrokerNotSetUp(self.ERROR)
+
+
+# the actors are declared on it at import, setup_broker() moves them to the real one
+declaring_broker = StubBroker()
+declaring_broker.add_middleware(DeclaringOnly())
+dramatiq.set_broker(declaring_broker)
+
+
+def setup_broker(broker=None):
+    """ at startup, not on import: binds the actors to broker (redis by default),
+        the workers run as `dramatiq drunner:setup_broker` """
+    broker = broker or RedisBroker(host=REDIS_HOST)
+    profiling.add_middleware(broker)
+    dramatiq.set_broker(broker)
+    for name in declaring_broker.get_declared_actors():
+        actor = declaring_broker.get_actor(name)
+        actor.broker = broker
+        broker.declare_actor(actor)
+    return broker
+
+
+# Scans are run as a pipeline of stages, each one on its own queue so the
+# number of workers for each of them can be sized independently, ie:
+#   dramatiq drunner:setup_broker -Q fetch -p 1 -t 8
+#   dramatiq drunner:setup_broker -Q scan -p 2 -t 1
+#   dramatiq drunner:setup_broker -Q process -p 4 -t 1
+FETCH_QUEUE = os.environ.get('FETCH_QUEUE', 'fetch')
+SCAN_QUEUE = os.environ.get('SCAN_QUEUE', 'scan')
+PROCESS_QUEUE = os.environ.get('PROCESS_QUEUE', 'process')
+# Stages may run in different workers, the checkout is kept here between them
+# (must be shared by all the workers of a pipeline).
+WORK_DIR = os.environ.get('WORK_DIR', os.path.join(tempfile.gettempdir(), 'drunner-work'))
+# per stage timeouts (seconds)
+CLONE_TIMEOUT = int(os.environ.get('CLONE_TIMEOUT', 600))
+CHECKOUT_TIMEOUT = int(os.environ.get('CHECKOUT_TIMEOUT', 120))
+SCAN_TIMEOUT = int(os.environ.get('SCAN_TIMEOUT', 1200))
+# dramatiq's time limit is a last resort, stages must time out before it
+TIME_LIMIT_SLACK = 60
+# how containers are run: 'cli' (docker client in a shell) or 'api' (docker daemon's API)
+DOCKER_BACKEND = os.environ.get('DOCKER_BACKEND', 'cli')
+# processes parsing reports on a bulk rebuild (0: parse in the actor's thread)
+REBUILD_PROCESSES = int(os.environ.get('REBUILD_PROCESSES', os.cpu_count() or 1))
 
 
 @contextmanager
@@ -30,6 +97,12 @@ def SwitchDir(dirname: str):
 
 class ScannerRunner(object):
     OUTPUT_DIR_NAME = 'out'
+    # where tmpdir is mounted in the scanner's container
+    MOUNT_POINT = '/scanme'
+    # bump it when process_report changes, reports built before are rebuilt
+    PARSER_VERSION = 3
+    # files outside the scanned path that still affect it (see carry_over)
+    SHARED_FILES = ('Cargo.toml', 'Cargo.lock')
     Scanners = {}
 
     @classmethod
@@ -91,49 +164,328 @@ class ScannerRunner(object):
         self.tmpdir = None
 
     def run(self):
+        """ run all the stages, one after the other, in this process """
         try:
             self.m.save()
             with tempfile.TemporaryDirectory(prefix='drunner-'+self.m.scanner,
                                              suffix='tmp') as self.tmpdir:
                 return self._run()
+        except ScanCancelled:
+            self.m.status = model.ScanStatus.Cancelled
         except:
             self.m.errors = traceback.format_exc()
-            self.m.save()
+            self.m.save(only=[model.ScannerExec.errors])
+            self.m.set_status(model.ScanStatus.Failed)
 
     def _run(self):
+        if not self.fetch_source():
+            return None
+        self.run_scanner()
+        return self.build_report()
+
+    @contextmanager
+    def timed(self, stage: str):
+        """ record how long the block took as a StageTiming of the scan """
+        start = datetime.datetime.now()
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            model.StageTiming.create(scan=self.m, stage=stage, start=start,
+                                     duration=time.monotonic() - t0)
+
+    def set_status(self, status):
+        if not self.m.set_status(status):
+            raise ScanCancelled(f'Scan {self.m.id} was cancelled.')
+
+    def fetch_source(self) -> bool:
+        """ returns False if the scan doesn't need to go on """
+        self.set_status(model.ScanStatus.Fetching)
         self.prepare_image()
-        self.run_image()
-        raw_report = self.fetch_raw_output()
-        model.Report.Create(docker=self.m, is_raw=True, content=raw_report)
-        report = self.process_report(self.m.get_raw_report().content)
-        model.Report.Create(docker=self.m, is_raw=False, content=report.to_json())
+        if self.m.incremental and self.carry_over():
+            self.set_status(model.ScanStatus.Done)
+            return False
+        self.set_status(model.ScanStatus.Fetched)
+        return True
+
+    def scanner_version(self):
+        return self.m.scanner_version
+
+    def carry_over(self) -> bool:
+        """ reuse the reports of the last scan if path didn't change since then """
+        self.scanner_version()
+        previous = self.m.last_scanned()
+        if previous is None or previous.get_common_report() is None:
+            return False
+        if previous.rev_hash != self.m.rev_hash:
+            paths = ' '.join([self.path] + list(self.SHARED_FILES))
+            ex = self.exec('repo-diff-revision',
+                           [f'git diff --quiet {previous.rev_hash} {self.m.rev_hash} -- {paths}'],
+                           'srcs', timeout=CHECKOUT_TIMEOUT)
+            self.check_exec(ex)
+            if ex.ret != 0:
+                # 1: there are changes, otherwise: can't tell (ie: unknown revision)
+                return False
+        self.m.carry_over(previous)
+        return True
+
+    def run_scanner(self):
+        self.set_status(model.ScanStatus.Scanning)
+        with self.timed('docker'), self.tail_findings():
+            ex = self.run_image()
+        self.check_exec(ex)
+        with self.timed('report_fetch'):
+            self.store_raw_output()
+        self.set_status(model.ScanStatus.Scanned)
+
+    def build_report(self):
+        self.set_status(model.ScanStatus.Processing)
+        with self.timed('process_report'):
+            report = self.process_report(self.m.get_raw_report().lines())
+        with self.timed('db_write'):
+            self.store_report(report)
+        self.set_status(model.ScanStatus.Done)
         return report
 
+    def store_report(self, report: ResultsReport):
+        self.save_report(report.to_json(), [f.as_dict() for f in report.findings or []])
+
+    def save_report(self, content: str, findings: list):
+        """ save (or replace) the common report and its findings """
+        with model.db.atomic(lock_type='IMMEDIATE'):
+            rep = self.m.get_common_report()
+            if rep is None:
+                rep = model.Report(docker=self.m, is_raw=False)
+            rep.content = content
+            rep.parser_version = self.PARSER_VERSION
+            rep.timestamp = datetime.datetime.now()
+            rep.save()
+            model.ScanFinding.Replace(self.m, findings)
+
+    def line_parser(self):
+        """ raw report line -> Finding or None, for scanners whose report can
+            be parsed line by line while it's being written """
+        return None
+
+    # how often the raw report is checked for new lines while the scanner runs
+    TAIL_INTERVAL = 1
+
+    @contextmanager
+    def tail_findings(self):
+        """ add the findings of the raw report lines as they are written """
+        parse = self.line_parser()
+        if parse is None:
+            yield
+            return
+        done = threading.Event()
+        thread = threading.Thread(target=self._tail, args=(parse, done))
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def _tail(self, parse, done: threading.Event):
+        offset, pending = 0, b''
+        while True:
+            finished = done.wait(self.TAIL_INTERVAL)
+            try:
+                with open(self.raw_output_fname, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                data = b''
+            offset += len(data)
+            *lines, pending = (pending + data).split(b'\n')
+            findings = []
+            for line in lines:
+                try:
+                    finding = parse(line)
+                except Exception:
+                    continue  # process_report will tell
+                if finding is not None:
+                    findings.append(finding.as_dict())
+            if findings:
+                model.ScanFinding.Add(self.m, findings, partial=True)
+            if finished:
+                return
+
+    Stages = ('fetch_source', 'run_scanner', 'build_report')
+    # timing name for the time spent waiting in the stage's queue
+    QueueWait = {'fetch_source': 'wait_fetch',
+                 'run_scanner': 'wait_scan',
+                 'build_report': 'wait_process'}
+
+    @classmethod
+    def RunStage(cls, scan_id: int, stage: str) -> bool:
+        return cls.FromId(scan_id).run_stage(stage)
+
+    def run_stage(self, stage: str) -> bool:
+        """ run a single stage using the scan's work dir, returns True if the
+            pipeline must go on with the next stage """
+        if not stage in self.Stages:
+            raise ValueError(f'Unknown stage: {stage}')
+        if self.m.status in model.ScanStatus.Finished:
+            # ie: cancelled while it waited in the queue
+            self.close_workdir()
+            self.m.drop_partial_findings()
+            return False
+        if self.m.status_at is not None:
+            wait = (datetime.datetime.now() - self.m.status_at).total_seconds()
+            model.StageTiming.create(scan=self.m, stage=self.QueueWait[stage],
+                                     start=self.m.status_at, duration=wait)
+        try:
+            self.tmpdir = self.open_workdir()
+            getattr(self, stage)()
+        except ScanCancelled:
+            self.m.status = model.ScanStatus.Cancelled
+        except:
+            self.m.errors = traceback.format_exc()
+            self.m.save(only=[model.ScannerExec.errors])
+            self.m.set_status(model.ScanStatus.Failed)
+        if self.m.finished:
+            self.close_workdir()
+            self.m.drop_partial_findings()
+            return False
+        return True
+
+    def open_workdir(self) -> str:
+        if self.m.workdir is None or not os.path.isdir(self.m.workdir):
+            os.makedirs(WORK_DIR, exist_ok=True)
+            self.m.workdir = tempfile.mkdtemp(prefix=f'drunner-{self.m.scanner}-{self.m.id}-',
+                                              suffix='tmp', dir=WORK_DIR)
+            self.m.save(only=[model.ScannerExec.workdir])
+        return self.m.workdir
+
+    def close_workdir(self):
+        if self.m.workdir is not None:
+            shutil.rmtree(self.m.workdir, ignore_errors=True)
+            self.m.workdir = None
+            self.m.save(only=[model.ScannerExec.workdir])
+
     def rebuild(self):
         raw_rep = self.m.get_raw_report()
         if raw_rep is None:
             return
-        report = self.process_report(raw_rep.content)
-        rep = self.m.get_common_report()
-        if rep is None:
-            model.Report.Create(docker=self.m, is_raw=False,
-                                content=report.to_json())
+        report = self.process_report(raw_rep.lines())
+        self.store_report(report)
+
+    @classmethod
+    def StaleScans(cls, force=False) -> list:
+        """ ids of the scans with a raw report whose common report is missing
+            or was built by another version of the scanner's parser """
+        common = model.Report.alias()
+        query = (model.ScannerExec
+                 .select(model.ScannerExec.id, model.ScannerExec.scanner, common.parser_version)
+                 .join(model.Report, on=((model.Report.docker == model.ScannerExec.id) &
+                                         (model.Report.is_raw == True)))
+                 .switch(model.ScannerExec)
+                 .join(common, JOIN.LEFT_OUTER, on=((common.docker == model.ScannerExec.id) &
+                                                    (common.is_raw == False)))
+                 .order_by(model.ScannerExec.id)
+                 .tuples())
+        versions, stale = {}, []
+        for scan_id, scanner, parser_version in query:
+            if not scanner in versions:
+                try:
+                    versions[scanner] = cls.Get(scanner).PARSER_VERSION
+                except UnknownScanner:
+                    versions[scanner] = None
+            if versions[scanner] is None:
+                continue
+            if force or parser_version != versions[scanner]:
+                stale.append(scan_id)
+        return list(dict.fromkeys(stale))
+
+    @classmethod
+    def RebuildAll(cls, job_id: int):
+        """ rebuild the stale reports, parsing them in a process pool """
+        job = model.RebuildJob.get_by_id(job_id)
+        scan_ids = cls.StaleScans(job.force)
+        job.total, job.status = len(scan_ids), 'running'
+        job.save()
+        errors = []
+
+        def save(scan_id, result):
+            content, findings, error = result
+            if error is None:
+                cls.FromId(scan_id).save_report(content, findings)
+                job.done += 1
+            else:
+                errors.append(f'scan {scan_id}: {error}')
+                job.failed += 1
+            job.save(only=[model.RebuildJob.done, model.RebuildJob.failed])
+
+        if REBUILD_PROCESSES <= 0:
+            for scan_id in scan_ids:
+                save(scan_id, parse_report(scan_id))
         else:
-            rep.content = report.to_json()
-            rep.save()
+            # spawn: children must not inherit the parent's db connection
+            with ProcessPoolExecutor(REBUILD_PROCESSES, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=dbchild.no_upgrade) as pool:
+                # a few reports parsed ahead: the parsed ones wait in memory to be saved
+                scans, pending = iter(scan_ids), {}
+                while True:
+                    for scan_id in itertools.islice(scans, 2*REBUILD_PROCESSES - len(pending)):
+                        pending[pool.submit(parse_report, scan_id)] = scan_id
+                    if not pending:
+                        break
+                    done, _ = wait_futures(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        save(pending.pop(future), future.result())
+        job.status = 'done'
+        job.errors = '\n'.join(errors) or None
+        job.finished = datetime.datetime.now()
+        job.save()
 
 
     @property
     def output_fname(self):
         return os.path.join(self.tmpdir, self.OUTPUT_DIR_NAME, 'report.json')
 
-    def exec(self, kind, cmdargs, wd=None, env=None) -> model.Execution:
+    def exec(self, kind, cmdargs, wd=None, env=None, timeout=None, on_kill=None) -> model.Execution:
         if wd is None:
             wd = self.tmpdir
         else:
             if not os.path.isabs(wd):
                 wd = os.path.join(self.tmpdir, wd)
-        return worker.exec(self.__class__.__name__+"-"+kind, cmdargs, wd=wd, env=env, de=self.m)
+        return worker.exec(self.__class__.__name__+"-"+kind, cmdargs, wd=wd, env=env, de=self.m,
+                           timeout=timeout, cancelled=self.m.is_cancelled, on_kill=on_kill)
+
+    def check_exec(self, ex: model.Execution, error: Exception = None):
+        if ex.killed == model.Execution.KILLED_CANCELLED:
+            raise ScanCancelled(f'Scan {self.m.id} was cancelled.')
+        if ex.killed is not None:
+            raise StageTimeout(f'{ex.kind} {ex.killed} after {ex.duration:.0f}s')
+        if ex.ret != 0 and error is not None:
+            raise error
+
+    @property
+    def container_name(self):
+        return f'drunner-{self.m.scanner}-{self.m.id}'
+
+    def kill_container(self):
+        """ the docker client going away doesn't stop the container """
+        subprocess.run(['docker', 'kill', self.container_name],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+
+    def run_container(self, kind, env, mount=True, timeout=SCAN_TIMEOUT) -> model.Execution:
+        """ docker run IMAGE with env, tmpdir mounted at MOUNT_POINT """
+        volumes = {self.tmpdir: {'bind': self.MOUNT_POINT, 'mode': 'rw'}} if mount else {}
+        name = self.container_name if mount else None
+        cmd = ' '.join(['docker run -i --rm'] +
+                       ([f'--name {name}'] if name else []) +
+                       [f'-e {shlex.quote(f"{key}={value}")}' for key, value in env.items()] +
+                       [f'-v {host}:{vol["bind"]}' for host, vol in volumes.items()] +
+                       [self.IMAGE])
+        if DOCKER_BACKEND != 'api':
+            return self.exec(kind, [cmd], timeout=timeout,
+                             on_kill=self.kill_container if name else None)
+        ex = model.Execution.Create(self.__class__.__name__+"-"+kind, [cmd],
+                                    wd=self.tmpdir, env=env, scan=self.m)
+        return dockerapi.run(ex, self.IMAGE, environment=env, volumes=volumes, name=name,
+                             timeout=timeout, cancelled=self.m.is_cancelled)
 
     def prepare_image(self):
         """
@@ -144,21 +496,25 @@ class ScannerRunner(object):
         - tmpdir is expected to be mounted somewhere in the container
         """
         os.mkdir(os.path.join(self.tmpdir, self.OUTPUT_DIR_NAME))
-        ex1 = self.exec('repo-clone', [f'git clone {self.repo} srcs'])
-        if ex1.ret!=0:
-            raise CloneFailed('git clone failed')
-        ex2 = self.exec('repo-checkout-revision', [f'git checkout {self.commit}'], 'srcs')
-        if ex2.ret!=0:
-            raise CheckoutFailed('git checkout failed')
-        ex3 = self.exec('repo-get-revision', [f'git rev-parse HEAD'], 'srcs')
-        if ex3.ret!=0:
-            raise CheckoutFailed('git rev-parse HEAD failed')
-        ex3.scan.rev_hash = ex3.output
-        ex3.scan.save()
-
-    def fetch_raw_output(self) -> bytes:
-        with open(os.path.join(self.tmpdir, self.CONTAINER_RAW_REPORT_NAME), 'rb') as f:
-            return f.read()
+        with self.timed('clone'):
+            ex1 = self.exec('repo-clone', [f'git clone {self.repo} srcs'], timeout=CLONE_TIMEOUT)
+        self.check_exec(ex1, CloneFailed('git clone failed'))
+        with self.timed('checkout'):
+            ex2 = self.exec('repo-checkout-revision', [f'git checkout {self.commit}'], 'srcs',
+                            timeout=CHECKOUT_TIMEOUT)
+            self.check_exec(ex2, CheckoutFailed('git checkout failed'))
+            ex3 = self.exec('repo-get-revision', [f'git rev-parse HEAD'], 'srcs', timeout=CHECKOUT_TIMEOUT)
+        self.check_exec(ex3, CheckoutFailed('git rev-parse HEAD failed'))
+        self.m.rev_hash = ex3.output
+        self.m.save(only=[model.ScannerExec.rev_hash])
+
+    @property
+    def raw_output_fname(self):
+        return os.path.join(self.tmpdir, self.CONTAINER_RAW_REPORT_NAME)
+
+    def store_raw_output(self) -> model.Report:
+        """ streams the raw report from the output file to the db """
+        return model.Report.CreateFromFile(self.m, True, self.raw_output_fname)
 
     @classmethod
     def GenericTaskRunner(cls, eid: int, task_kind_str: str):
@@ -166,11 +522,24 @@ class ScannerRunner(object):
             with tempfile.TemporaryDirectory(prefix=f'drunner-{task_kind_str}-',
                                              suffix='tmp') as tmpdir:
                 e = model.Execution.get_by_id(eid)
+                if DOCKER_BACKEND == 'api' and cls.ImageTask(e, tmpdir):
+                    return
                 r = worker.exec(task_kind_str, wd=tmpdir, e=e,
                                 env=json.loads(e.env) if e.env else None)
         except:
             traceback.print_exc()
 
+    @classmethod
+    def ImageTask(cls, e: model.Execution, wd: str) -> bool:
+        """ run BuildMe / UpdateMe executions through the docker api """
+        for klass in list(cls.Scanners.values()) + [TestScanRunner]:
+            if e.kind == 'custom-build-'+klass.__name__:
+                dockerapi.build(e, wd, klass.IMAGE)
+                return True
+            if e.kind == 'custom-update-'+klass.__name__:
+                dockerapi.pull(e, klass.IMAGE)
+                return True
+        return False
 
     @classmethod
     def Build_test_scanner(cls, eid: int):
@@ -185,6 +554,16 @@ class ScannerRunner(object):
             traceback.print_exc()
 
 
+def parse_report(scan_id: int):
+    """ (report json, findings, None) or (None, None, error), runs in RebuildAll's pool """
+    try:
+        runner = ScannerRunner.FromId(scan_id)
+        report = runner.process_report(runner.m.get_raw_report().lines())
+        return report.to_json(), [f.as_dict() for f in report.findings or []], None
+    except Exception:
+        return None, None, traceback.format_exc()
+
+
 def PrioStr(p: Priority) -> str:
     return str(p).split('.')[-1]
 
@@ -194,11 +573,10 @@ class TestScanRunner(ScannerRunner):
     CONTAINER_RAW_REPORT_NAME = os.path.join(ScannerRunner.OUTPUT_DIR_NAME, 'output.txt')
 
     def run_image(self):
-        cmd = (f'docker run -i --rm '
-               f'-e INPUT_TARGET=/scanme/srcs/{self.path} '
-               f'-e OUTPUT_NAME=/scanme/{self.CONTAINER_RAW_REPORT_NAME} '
-               f'-v {self.tmpdir}:/scanme {self.IMAGE}')
-        return self.exec('run-image', [cmd])
+        return self.run_container('run-image', {
+            'INPUT_TARGET': f'{self.MOUNT_POINT}/srcs/{self.path}',
+            'OUTPUT_NAME': f'{self.MOUNT_POINT}/{self.CONTAINER_RAW_REPORT_NAME}',
+        })
 
     def process_report(self, raw_report):
         report = ResultsReport(
@@ -224,14 +602,44 @@ class TestScanRunner(ScannerRunner):
 @dramatiq.actor(time_limit=1200000)
 def execute_task(task_id):
     a_task = model.ScannerExec.get_by_id(task_id)
-    runner = ScannerRunner.GetForExec(a_task)
-    runner.run()
+    a_task.set_status(model.ScanStatus.Queued)
+    fetch_source_task.send(task_id)
+
+
+@dramatiq.actor(queue_name=FETCH_QUEUE,
+                time_limit=(CLONE_TIMEOUT + 2*CHECKOUT_TIMEOUT + TIME_LIMIT_SLACK)*1000)
+def fetch_source_task(task_id):
+    if ScannerRunner.RunStage(task_id, 'fetch_source'):
+        run_scanner_task.send(task_id)
+
+
+@dramatiq.actor(queue_name=SCAN_QUEUE, time_limit=(SCAN_TIMEOUT + TIME_LIMIT_SLACK)*1000)
+def run_scanner_task(task_id):
+    if ScannerRunner.RunStage(task_id, 'run_scanner'):
+        process_report_task.send(task_id)
+
+
+@dramatiq.actor(queue_name=PROCESS_QUEUE, time_limit=1200000)
+def process_report_task(task_id):
+    ScannerRunner.RunStage(task_id, 'build_report')
 
 
 @dramatiq.actor(time_limit=1200000)
 def execute_batch(batch_id, tasks_ids=()):
-    for task_id in tasks_ids:
-        execute_task.send(task_id)
+    # a group is one broker.enqueue per message: done here, by a worker, and not
+    # by the request that submitted the batch
+    dramatiq.group([execute_task.message(task_id) for task_id in tasks_ids],
+                   broker=execute_task.broker).run()
+
+
+@dramatiq.actor(queue_name=PROCESS_QUEUE, time_limit=24*3600*1000, max_retries=0)
+def rebuild_reports_task(job_id: int):
+    try:
+        ScannerRunner.RebuildAll(job_id)
+    except:
+        model.RebuildJob.update(status='failed', errors=traceback.format_exc(),
+                                finished=datetime.datetime.now()) \
+            .where(model.RebuildJob.id == job_id).execute()
 
 
 @dramatiq.actor
@@ -1,3 +1,6 @@
+from dramatiq.middleware import MiddlewareError
+
+
 class RunnerException(Exception):
     pass
 
@@ -11,4 +14,17 @@ class CheckoutFailed(RunnerException):
 
 
 class UnknownScanner(RunnerException):
-    pass
\ No newline at end of file
+    pass
+
+
+class StageTimeout(RunnerException):
+    pass
+
+
+class ScanCancelled(RunnerException):
+    pass
+
+
+class BrokerNotSetUp(MiddlewareError):
+    """ an actor's message sent before setup_broker() """
+    pass
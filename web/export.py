@@ -0,0 +1,190 @@
+"""
+Composite (whole batch) exports: csv, ndjson and, with pyarrow installed,
+parquet and arrow.
+
+Rows come from ScanFinding joined with its scan, filtered in the query and
+streamed, so exports start right away and use constant memory.
+"""
+import csv
+import json
+
+from model import ScannerExec, ScanFinding
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+def last_path_no_dot(astr: str) -> str:
+    if '/' in astr:
+        astr = astr.split('/')[-1]
+    if '.' in astr:
+        astr = astr.split('.')[0]
+    return astr
+
+
+# name -> (field selected, conversion of its value, arrow type name)
+COLUMNS = {
+    'scanner': (ScanFinding.scanner, None, 'string'),
+    'repo name': (ScannerExec.repo, last_path_no_dot, 'string'),
+    'repo url': (ScannerExec.repo, None, 'string'),
+    'commit': (ScannerExec.commit, None, 'string'),
+    'revision': (ScannerExec.rev_hash, None, 'string'),
+    'path': (ScannerExec.path, None, 'string'),
+    'finding': (ScanFinding.name, None, 'string'),
+    'level': (ScanFinding.level, None, 'string'),
+    'filename': (ScanFinding.filename, None, 'string'),
+    'lineno': (ScanFinding.lineno, None, 'int64'),
+    'category': (ScanFinding.category, None, 'string'),
+    'description': (ScanFinding.desc, None, 'string'),
+    'fingerprint': (ScanFinding.fingerprint, None, 'string'),
+    'scan id': (ScannerExec.id, None, 'int64'),
+    'partial': (ScanFinding.partial, None, 'bool'),
+}
+# what the csv export always had
+DEFAULT_COLUMNS = ('scanner', 'repo name', 'repo url', 'commit', 'revision', 'path',
+                   'finding', 'level', 'filename', 'lineno')
+
+# rows per parquet row group / arrow record batch
+BATCH_ROWS = 10000
+
+
+class ExportError(ValueError):
+    pass
+
+
+def check_columns(columns):
+    unknown = [c for c in columns if c not in COLUMNS]
+    if unknown:
+        raise ExportError(f'Unknown columns: {", ".join(unknown)} (valid: {", ".join(COLUMNS)})')
+
+
+def rows(batch_id: int, columns=DEFAULT_COLUMNS, levels=None, scanners=None, partial=False):
+    """ tuples with the columns of the batch's findings (and the partial ones
+        of its running scans if partial) """
+    check_columns(columns)
+    fields = [COLUMNS[c][0] for c in columns]
+    converters = [(idx, COLUMNS[c][1]) for idx, c in enumerate(columns) if COLUMNS[c][1]]
+    query = (ScanFinding.select(*fields)
+             .join(ScannerExec)
+             .where(ScannerExec.batch == batch_id)
+             .order_by(ScannerExec.id, ScanFinding.id))
+    if not partial:
+        query = query.where(ScanFinding.partial == False)
+    if levels:
+        query = query.where(ScanFinding.level.in_(levels))
+    if scanners:
+        query = query.where(ScanFinding.scanner.in_(scanners))
+    for row in query.tuples().iterator():
+        if converters:
+            row = list(row)
+            for idx, convert in converters:
+                if row[idx] is not None:
+                    row[idx] = convert(row[idx])
+        yield row
+
+
+class _Line:
+    """ file for csv.writer, writerow returns the line """
+    def write(self, line):
+        return line
+
+
+def to_csv(columns, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def to_ndjson(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row))) + '\n'
+
+
+def _check_pyarrow(fmt):
+    if pyarrow is None:
+        raise ExportError(f'{fmt} exports require pyarrow (pip install pyarrow).')
+
+
+def _record_batches(columns, rows):
+    schema = pyarrow.schema([(c, getattr(pyarrow, COLUMNS[c][2])()) for c in columns])
+
+    def record_batch(chunk):
+        return pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array([row[idx] for row in chunk], type=field.type)
+             for idx, field in enumerate(schema)],
+            schema=schema)
+    chunk, sent = [], False
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == BATCH_ROWS:
+            yield record_batch(chunk)
+            chunk, sent = [], True
+    if chunk or not sent:
+        yield record_batch(chunk)
+
+
+class _Chunks:
+    """ writable sink for pyarrow, handing what was written so far to the response """
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        chunks, self.chunks = self.chunks, []
+        return b''.join(chunks)
+
+
+def _arrow_stream(columns, rows, open_writer):
+    sink = _Chunks()
+    writer = None
+    for batch in _record_batches(columns, rows):
+        if writer is None:
+            writer = open_writer(pyarrow.PythonFile(sink, mode='w'), batch.schema)
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def to_parquet(columns, rows):
+    return _arrow_stream(columns, rows, pyarrow.parquet.ParquetWriter)
+
+
+def to_arrow(columns, rows):
+    return _arrow_stream(columns, rows, pyarrow.ipc.new_stream)
+
+
+# name -> (writer, mimetype, file extension, needs pyarrow)
+FORMATS = {
+    'csv': (to_csv, 'text/csv', 'csv', False),
+    'ndjson': (to_ndjson, 'application/x-ndjson', 'ndjson', False),
+    'parquet': (to_parquet, 'application/vnd.apache.parquet', 'parquet', True),
+    'arrow': (to_arrow, 'application/vnd.apache.arrow.stream', 'arrow', True),
+}
+
+
+def export(batch_id: int, fmt='csv', columns=None, levels=None, scanners=None, partial=False):
+    """ (content generator, mimetype, file extension) of the batch's findings """
+    if fmt not in FORMATS:
+        raise ExportError(f'Unknown format: {fmt} (valid: {", ".join(FORMATS)})')
+    writer, mimetype, extension, arrow = FORMATS[fmt]
+    if arrow:
+        _check_pyarrow(fmt)
+    columns = list(columns or DEFAULT_COLUMNS)
+    check_columns(columns)
+    return writer(columns, rows(batch_id, columns, levels, scanners, partial)), mimetype, extension
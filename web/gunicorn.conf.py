@@ -0,0 +1,25 @@
+"""
+gunicorn settings for serving the web app:
+
+    gunicorn -c gunicorn.conf.py
+
+WEB_WORKERS processes with WEB_THREADS threads each, listening on BIND.
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'app:create_app()'
+bind = os.environ.get('BIND', f"{os.environ.get('LISTEN_IP', '0.0.0.0')}:5000")
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# the db is created/upgraded once, by the master, before forking the workers
+preload_app = True
+accesslog = '-'
+
+
+def pre_fork(server, worker):
+    # the workers open their own connections
+    from model import db
+    db.close()
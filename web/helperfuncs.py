@@ -5,7 +5,7 @@ from traceback import print_exc
 
 from flask import url_for, render_template
 
-from model import get_scans, get_batchs
+from model import get_scans, get_batchs, Counter
 
 
 def enumwid(it):
@@ -42,12 +42,26 @@ def float_to_seconds(x, unit='s'):
     return "{:.2f}{unit}".format(x, unit=unit)
 
 
+# (Counter.SIDEBAR version, scans, batchs)
+_sidebar = (None, None, None)
+
+
+def sidebar():
+    """ (scans, batchs) of the side columns, only queried again after they change """
+    global _sidebar
+    version = Counter.Get(Counter.SIDEBAR)
+    if _sidebar[0] != version:
+        _sidebar = (version, get_scans(), get_batchs())
+    return _sidebar[1:]
+
+
 def render(template, **kwargs):
     class Funcs: pass
     funcs = Funcs()
     now = datetime.datetime.now()
-    new = {'scans': get_scans(),
-           'batchs': get_batchs(),
+    scans, batchs = sidebar()
+    new = {'scans': scans,
+           'batchs': batchs,
            'None': None,
            'short_repo':lambda x: '../'+x.rsplit('/', 1)[1].replace('.git', ''),
            'datetime': datetime.datetime,
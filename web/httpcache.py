@@ -0,0 +1,101 @@
+"""
+Conditional responses (ETag / Last-Modified -> 304 Not Modified) for the
+content that doesn't change anymore (finished executions, written reports)
+and gzip compression of the big text responses.
+"""
+import datetime
+import os
+import zlib
+
+from flask import request, Response, make_response
+
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 2048))
+GZIP_LEVEL = 6
+# gzipped responses get another (strong) etag than the identity ones
+GZIP_ETAG_SUFFIX = '-gz'
+COMPRESSIBLE = ('text/', 'application/json', 'application/x-ndjson', 'application/javascript')
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def _templates_version():
+    """ pages rendered by other templates are other pages """
+    return int(max((os.path.getmtime(os.path.join(TEMPLATES_DIR, name))
+                    for name in os.listdir(TEMPLATES_DIR)), default=0))
+
+
+TEMPLATES_VERSION = _templates_version()
+
+
+def page_etag(*parts) -> str:
+    return '-'.join(str(part) for part in parts + (TEMPLATES_VERSION,))
+
+
+def _utc(when: datetime.datetime) -> datetime.datetime:
+    # the db's timestamps are naive local times
+    return when.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+def not_modified(etag: str, last_modified: datetime.datetime = None) -> bool:
+    """ the client's copy (If-None-Match, or else If-Modified-Since) is current """
+    if request.if_none_match:
+        return (request.if_none_match.contains(etag) or
+                request.if_none_match.contains(etag + GZIP_ETAG_SUFFIX))
+    if last_modified is not None and request.if_modified_since is not None:
+        return _utc(last_modified) <= request.if_modified_since
+    return False
+
+
+def conditional(etag: str, last_modified: datetime.datetime, build) -> Response:
+    """ build()'s response, or a 304 if the client has it already """
+    if not_modified(etag, last_modified):
+        response = Response(status=304)
+        # the etag of the representation the client has
+        if request.if_none_match.contains(etag + GZIP_ETAG_SUFFIX):
+            etag += GZIP_ETAG_SUFFIX
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _utc(last_modified)
+    # cached, but always revalidated
+    response.cache_control.no_cache = True
+    return response
+
+
+def _gzip_stream(chunks):
+    z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = z.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield z.flush()
+
+
+def compress(response: Response) -> Response:
+    """ after_request: gzip text responses, streamed ones on the fly """
+    if (response.status_code < 200 or response.status_code in (204, 304) or
+            'Content-Encoding' in response.headers or
+            not (response.mimetype or '').startswith(COMPRESSIBLE)):
+        return response
+    response.vary.add('Accept-Encoding')
+    if not request.accept_encodings['gzip']:
+        return response
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response)
+        response.direct_passthrough = False
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < GZIP_MIN_SIZE:
+            return response
+        response.set_data(zlib.compress(data, GZIP_LEVEL, wbits=16 + zlib.MAX_WBITS))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(etag + GZIP_ETAG_SUFFIX, weak)
+    return response
+
+
+def init_app(app):
+    app.after_request(compress)
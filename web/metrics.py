@@ -0,0 +1,93 @@
+from peewee import fn, Case
+
+from model import ScannerExec, StageTiming, OutputLine, Execution, ScanStatus
+
+# upper bounds (seconds) of the stage latency histogram buckets
+BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+
+# status a scan has while it waits in each stage's queue
+QUEUED_STATUS = {
+    'fetch': ScanStatus.Queued,
+    'scan': ScanStatus.Fetched,
+    'process': ScanStatus.Scanned,
+}
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class Metrics:
+    """ prometheus text exposition format, everything is computed from the db
+        so the numbers are the ones of all the workers together """
+
+    def __init__(self):
+        self.lines = []
+
+    def header(self, name, kind, help):
+        self.lines.append(f'# HELP {name} {help}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name, value, **labels):
+        self.lines.append(f'{name}{_labels(**labels)} {value}')
+
+    def render(self) -> str:
+        return '\n'.join(self.lines) + '\n'
+
+
+def scans_by_status(m: Metrics):
+    m.header('drunner_scans', 'gauge', 'Scans by status.')
+    query = (ScannerExec.select(ScannerExec.status, fn.COUNT(ScannerExec.id).alias('count'))
+             .group_by(ScannerExec.status))
+    for row in query:
+        m.sample('drunner_scans', row.count, status=row.status or 'unknown')
+
+
+def queue_depth(m: Metrics):
+    m.header('drunner_queue_depth', 'gauge', 'Scans waiting for each stage.')
+    counts = dict(ScannerExec.select(ScannerExec.status, fn.COUNT(ScannerExec.id))
+                  .where(ScannerExec.status.in_(list(QUEUED_STATUS.values())))
+                  .group_by(ScannerExec.status).tuples())
+    for queue, status in QUEUED_STATUS.items():
+        m.sample('drunner_queue_depth', counts.get(status, 0), queue=queue)
+
+
+def stage_latencies(m: Metrics):
+    name = 'drunner_stage_duration_seconds'
+    m.header(name, 'histogram', 'Time spent on each scan stage.')
+    buckets = [fn.SUM(Case(None, [(StageTiming.duration <= le, 1)], 0)) for le in BUCKETS]
+    query = (StageTiming.select(StageTiming.stage, fn.COUNT(StageTiming.id),
+                                fn.SUM(StageTiming.duration), *buckets)
+             .group_by(StageTiming.stage).tuples())
+    for stage, count, total, *cumulative in query:
+        for le, value in zip(BUCKETS, cumulative):
+            m.sample(name + '_bucket', value, stage=stage, le=le)
+        m.sample(name + '_bucket', count, stage=stage, le='+Inf')
+        m.sample(name + '_sum', total, stage=stage)
+        m.sample(name + '_count', count, stage=stage)
+
+
+def output_lines(m: Metrics):
+    m.header('drunner_output_lines_total', 'counter', 'Output lines written by executions.')
+    m.sample('drunner_output_lines_total', OutputLine.select(fn.MAX(OutputLine.id)).scalar() or 0)
+
+
+def executions(m: Metrics):
+    m.header('drunner_executions_killed_total', 'counter', 'Executions killed, by reason.')
+    query = (Execution.select(Execution.killed, fn.COUNT(Execution.id))
+             .where(Execution.killed.is_null(False))
+             .group_by(Execution.killed).tuples())
+    for reason, count in query:
+        m.sample('drunner_executions_killed_total', count, reason=reason)
+
+
+COLLECTORS = [scans_by_status, queue_depth, stage_latencies, output_lines, executions]
+
+
+def render_metrics() -> str:
+    m = Metrics()
+    for collector in COLLECTORS:
+        collector(m)
+    return m.render()
@@ -1,11 +1,21 @@
 import datetime
 import json
 import logging
+import mmap
 import os
 import time
 from collections import defaultdict
+from functools import cached_property
 
 from peewee import *
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from results import fingerprint, finding_extra
 
 ## debug queries..
 logger = logging.getLogger('peewee')
@@ -17,7 +27,12 @@ if os.environ.get('DBLOG', 'false').lower() == 'true':
 DB_FILE = os.environ.get("DB", os.path.join(
         os.path.dirname(os.path.abspath(__file__)),
         os.environ.get('DB_NAME','drunner.sqlite.db')))
-db = SqliteDatabase(DB_FILE)
+
+
+# several web and worker processes use it at once: with wal readers don't wait for writers.
+# A deferred transaction that reads before writing fails right away if another one wrote
+# meanwhile, instead of waiting for it: those begin with atomic(lock_type='IMMEDIATE')
+db = SqliteDatabase(DB_FILE, timeout=30, pragmas={'journal_mode': 'wal'})
 
 
 class BaseModel(Model):
@@ -28,37 +43,125 @@ class BaseModel(Model):
         return str(self)
 
 
+class JsonField(TextField):
+    """ structured data, stored as json text """
+    def db_value(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value, separators=(',', ':'))
+
+    def python_value(self, value):
+        return json_loads(value) if value else None
+
+
 class BatchExec(BaseModel):
     timestamp = DateTimeField(default=datetime.datetime.now, index=True)
     name = CharField(null=True)
     author = CharField(null=True)
     email = CharField(null=True)
     comments = TextField(null=True)
+    # reuse the reports of the last scan of paths unchanged since then
+    incremental = BooleanField(default=False)
 
     def __str__(self):
         return f'<{self.id}: {self.name} / {self.author} / {self.email} / {self.comments[:20]}>'
 
+    def change_token(self) -> str:
+        """ changes whenever a scan of the batch gets new, rebuilt or partial findings """
+        findings = (ScanFinding.select(fn.MAX(ScanFinding.id), fn.COUNT(ScanFinding.id))
+                    .join(ScannerExec).where(ScannerExec.batch == self).tuples().get())
+        reports = (Report.select(fn.MAX(Report.id))
+                   .join(ScannerExec).where(ScannerExec.batch == self).scalar())
+        return f'{findings[0]}:{findings[1]}:{reports}'
+
     def composite_report(self):
+        """ build_composite_report(), cached until the change_token() changes """
+        token = self.change_token()
+        cached = (CompositeReport.select(CompositeReport.content)
+                  .where(CompositeReport.batch == self, CompositeReport.token == token)
+                  .scalar())
+        if cached is not None:
+            scans = {scan.id: scan for scan in self.scans}
+            return [(scans[scan_id], vuln) for scan_id, vuln in json_loads(cached)]
+        vulns = self.build_composite_report()
+        CompositeReport.replace(
+            batch=self, token=token,
+            content=json.dumps([(scan.id, vuln) for scan, vuln in vulns], separators=(',', ':'))
+        ).execute()
+        return vulns
+
+    def build_composite_report(self):
         vulns = []
         for scan in self.scans:
             rep = scan.get_common_report()
             if rep is None:
+                # findings seen so far, if the scanner is still running
+                if not scan.finished:
+                    for vuln in scan.partial_findings():
+                        vulns.append((scan, vuln))
                 continue
             for vuln in rep.findings:
                 vulns.append((scan, vuln))
         return vulns
 
+    def finding_keys(self) -> dict:
+        """ (repo, path, fingerprint) -> ids of the batch's findings with it: the
+            same snippet can be found more than once in a file """
+        query = (ScanFinding.select(ScannerExec.repo, ScannerExec.path, ScanFinding.fingerprint,
+                                    ScanFinding.id)
+                 .join(ScannerExec)
+                 .where(ScannerExec.batch == self, ScanFinding.partial == False)
+                 .order_by(ScanFinding.id)
+                 .tuples())
+        keys = {}
+        for repo, path, fp, id in query:
+            keys.setdefault((repo, path, fp), []).append(id)
+        return keys
+
+    def diff(self, other: 'BatchExec') -> dict:
+        """ findings of other that are added/unchanged since this one, and the removed ones,
+            occurrences of a fingerprint are matched one to one """
+        old, new = self.finding_keys(), other.finding_keys()
+        diff = {'added': [], 'removed': [], 'unchanged': []}
+        for key in new.keys() | old.keys():
+            old_ids, new_ids = old.get(key, []), new.get(key, [])
+            matched = min(len(old_ids), len(new_ids))
+            diff['unchanged'] += new_ids[:matched]
+            diff['added'] += new_ids[matched:]
+            diff['removed'] += old_ids[matched:]
+        return {kind: sorted(ids) for kind, ids in diff.items()}
+
+
+class ScanStatus:
+    Queued = 'queued'
+    Fetching = 'fetching'
+    Fetched = 'fetched'
+    Scanning = 'scanning'
+    Scanned = 'scanned'
+    Processing = 'processing'
+    Done = 'done'
+    Failed = 'failed'
+    Cancelled = 'cancelled'
+
+    Finished = {Done, Failed, Cancelled}
+
 
 class ScannerExec(BaseModel):
     batch = ForeignKeyField(BatchExec, null=True,  backref='scans')
     timestamp = DateTimeField(default=datetime.datetime.now, index=True)
-    repo = CharField(unique=False)
+    repo = CharField(unique=False, index=True)
     commit = CharField(unique=False)
     rev_hash = CharField(unique=False, null=True)
     path = CharField(unique=False)
     scanner = CharField(unique=False, default="Scout", index=True)
     scanner_version = CharField(unique=False, null=True)
     errors = TextField(null=True)
+    # null status: scan created before stages were tracked
+    status = CharField(null=True, default=ScanStatus.Queued, index=True)
+    status_at = DateTimeField(null=True, default=datetime.datetime.now)
+    workdir = CharField(null=True)
+    # scan whose reports were reused because nothing changed since then
+    carried_from = ForeignKeyField('self', null=True, backref='carried_to')
 
     def __str__(self):
         return f'<{self.id}: B:{self.batch} {self.scanner}({self.repo}@{self.commit}:{self.path})>'
@@ -74,8 +177,94 @@ class ScannerExec(BaseModel):
             'commit': self.commit,
             'path': self.path,
             'scanner': self.scanner,
+            'status': self.status,
             'errors': self.errors,}
 
+    def set_status(self, status) -> bool:
+        """ returns False (and keeps it) if the scan was cancelled meanwhile """
+        now = datetime.datetime.now()
+        if status != ScanStatus.Cancelled:
+            updated = (ScannerExec.update(status=status, status_at=now)
+                       .where(ScannerExec.id == self.id,
+                              ScannerExec.status.is_null() | (ScannerExec.status != ScanStatus.Cancelled))
+                       .execute())
+            if not updated:
+                self.status = ScanStatus.Cancelled
+                return False
+        else:
+            ScannerExec.update(status=status, status_at=now).where(ScannerExec.id == self.id).execute()
+        self.status = status
+        self.status_at = now
+        return True
+
+    @classmethod
+    def CreateMany(cls, batch, tasks) -> list:
+        """ the batch's scans of tasks (dicts of repo, commit, path, scanner) in one
+            transaction, returns their ids """
+        now = datetime.datetime.now()
+        rows = [dict(task, batch=batch, timestamp=now, status=ScanStatus.Queued, status_at=now)
+                for task in tasks]
+        with db.atomic():
+            for idx in range(0, len(rows), 500):
+                cls.insert_many(rows[idx:idx+500]).execute()
+            return [id for id, in cls.select(cls.id).where(cls.batch == batch).order_by(cls.id).tuples()]
+
+    @property
+    def incremental(self):
+        return self.batch is not None and self.batch.incremental
+
+    def last_scanned(self):
+        """ last finished scan of the same target with the same scanner version """
+        version = (ScannerExec.scanner_version.is_null() if self.scanner_version is None
+                   else ScannerExec.scanner_version == self.scanner_version)
+        return (ScannerExec.select()
+                .where(ScannerExec.repo == self.repo,
+                       ScannerExec.path == self.path,
+                       ScannerExec.scanner == self.scanner,
+                       version,
+                       ScannerExec.status == ScanStatus.Done,
+                       ScannerExec.rev_hash.is_null(False),
+                       ScannerExec.id != self.id)
+                .order_by(ScannerExec.timestamp.desc())
+                .first())
+
+    def carry_over(self, previous: "ScannerExec"):
+        """ reuse previous' reports as this scan's ones """
+        with db.atomic(lock_type='IMMEDIATE'):
+            for report in previous.reports:
+                report.copy_to(self)
+            fields = [getattr(ScanFinding, name) for name in ScanFinding.Fields]
+            ScanFinding.insert_from(
+                ScanFinding.select(Value(self.id), Value(False), *fields)
+                .where(ScanFinding.scan == previous, ScanFinding.partial == False),
+                [ScanFinding.scan, ScanFinding.partial] + fields).execute()
+            self.carried_from = previous.carried_from or previous
+            self.save(only=[ScannerExec.carried_from])
+
+    def partial_findings(self):
+        """ findings extracted while the scanner is still running """
+        return [f.as_dict() for f in self.findings.where(ScanFinding.partial == True)
+                                                  .order_by(ScanFinding.id)]
+
+    def drop_partial_findings(self):
+        """ the ones of a scan that ended without a report (failed, cancelled) """
+        ScanFinding.delete().where(ScanFinding.scan == self, ScanFinding.partial == True).execute()
+
+    def is_cancelled(self) -> bool:
+        return (ScannerExec.select(ScannerExec.status)
+                .where(ScannerExec.id == self.id).scalar()) == ScanStatus.Cancelled
+
+    @classmethod
+    def Cancel(cls, *where) -> int:
+        """ mark as cancelled the not yet finished scans matching where """
+        return (cls.update(status=ScanStatus.Cancelled)
+                .where(cls.status.is_null(False), cls.status.not_in(ScanStatus.Finished), *where)
+                .execute())
+
+    @property
+    def finished(self):
+        return self.status is None or self.status in ScanStatus.Finished
+
     def get_common_report(self):
         try:
             return Report.select().where(Report.docker==self, Report.is_raw==False)[0]
@@ -119,6 +308,17 @@ class Report(BaseModel):
     docker = ForeignKeyField(ScannerExec, backref='reports')
     is_raw = BooleanField(default=True)
     content = TextField(null=False)
+    carried_from = ForeignKeyField('self', null=True)
+    # content is stored in ReportChunks instead (big raw reports)
+    chunked = BooleanField(default=False)
+    # ScannerRunner.PARSER_VERSION that built it (common reports)
+    parser_version = IntegerField(null=True)
+    # when its content was (last) written
+    timestamp = DateTimeField(null=True, default=datetime.datetime.now)
+
+    # approx. size of each ReportChunk, they always end at a line end
+    CHUNK_SIZE = 1024*1024
+
     def __str__(self):
         return f'<{self.id}: D:{self.docker} {"raw" if self.is_raw else "json"} {self.content[:20]}>'
 
@@ -126,13 +326,72 @@ class Report(BaseModel):
     def Create(cls, docker, is_raw, content):
         return Report.create(docker=docker, is_raw=is_raw, content=content)
 
+    @classmethod
+    def CreateFromFile(cls, docker, is_raw, fname):
+        """ store fname's content chunk by chunk, without reading it all in memory """
+        with db.atomic():
+            report = Report.create(docker=docker, is_raw=is_raw, content='', chunked=True)
+            if os.path.getsize(fname) == 0:
+                return report
+            with open(fname, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                idx, start = 0, 0
+                while start < len(mm):
+                    end = mm.find(b'\n', start + cls.CHUNK_SIZE)
+                    end = len(mm) if end == -1 else end + 1
+                    ReportChunk.create(report=report, idx=idx,
+                                       data=mm[start:end].decode('utf-8', errors='replace'))
+                    idx, start = idx + 1, end
+        return report
+
+    def iter_content(self):
+        """ content, a chunk at a time """
+        if not self.chunked:
+            yield self.content
+            return
+        query = (ReportChunk.select(ReportChunk.data)
+                 .where(ReportChunk.report == self)
+                 .order_by(ReportChunk.idx))
+        for chunk in query.tuples().iterator():
+            yield chunk[0]
+
+    def lines(self):
+        for chunk in self.iter_content():
+            yield from chunk.splitlines()
+
     @property
+    def text(self):
+        return ''.join(self.iter_content())
+
+    def copy_to(self, docker):
+        """ copy of this report for another scan, marked as carried over """
+        with db.atomic():
+            copy = Report.create(docker=docker, is_raw=self.is_raw, content=self.content,
+                                 chunked=self.chunked, carried_from=self.carried_from or self,
+                                 parser_version=self.parser_version, timestamp=self.timestamp)
+            ReportChunk.insert_from(
+                ReportChunk.select(Value(copy.id), ReportChunk.idx, ReportChunk.data)
+                .where(ReportChunk.report == self),
+                [ReportChunk.report, ReportChunk.idx, ReportChunk.data]).execute()
+        return copy
+
+    @cached_property
     def data(self):
-        return json.loads(self.content)
+        """ parsed once; findings of format 1 reports keep their jsonextra encoded
+            until findings decodes it """
+        return json_loads(self.content)
+
+    @property
+    def format(self):
+        return self.data.get('format', 1)
 
     @property
     def findings(self):
-        return self.data['findings']
+        """ with their jsonextra as a dict, whatever the format """
+        findings = self.data['findings']
+        if self.format == 1:
+            for finding in findings:
+                finding_extra(finding)
+        return findings
 
     @property
     def vulnstats(self):
@@ -152,6 +411,233 @@ class Report(BaseModel):
         ])
 
 
+class ScanFinding(BaseModel):
+    """ a results.Finding of a scan, one row each """
+    scan = ForeignKeyField(ScannerExec, backref='findings')
+    # found while the scanner was still running, replaced by the final report's
+    partial = BooleanField(default=False)
+    name = CharField(null=False)
+    desc = TextField(null=True)
+    category = CharField(null=True)
+    level = CharField(null=True, index=True)
+    filename = CharField(null=True)
+    lineno = IntegerField(null=True)
+    scanner = CharField(null=True, index=True)
+    jsonextra = JsonField(null=True)
+    # results.fingerprint(), the same finding on other scans has the same one
+    fingerprint = CharField(null=True, index=True)
+
+    def __str__(self):
+        return f'<{self.id}: S:{self.scan_id} {self.name} {self.filename}:{self.lineno}>'
+
+    Fields = ('name', 'desc', 'category', 'level', 'filename', 'lineno', 'scanner', 'jsonextra',
+              'fingerprint')
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.Fields}
+
+    @classmethod
+    def Add(cls, scan, findings, partial=False):
+        """ findings: Finding.as_dict()s """
+        rows = [dict(finding, scan=scan, partial=partial) for finding in findings]
+        for row in rows:
+            if not row.get('fingerprint'):
+                row['fingerprint'] = fingerprint(row['scanner'], row['name'], row['filename'],
+                                                 row['lineno'], row['jsonextra'])
+        with db.atomic():
+            for idx in range(0, len(rows), 100):
+                cls.insert_many(rows[idx:idx+100]).execute()
+
+    @classmethod
+    def WithScans(cls, ids) -> list:
+        """ (scan, finding) of the findings with those ids """
+        ids, found = list(ids), []
+        for idx in range(0, len(ids), 500):
+            query = (cls.select(cls, ScannerExec).join(ScannerExec)
+                     .where(cls.id.in_(ids[idx:idx+500])))
+            found.extend((f.scan, f) for f in query)
+        return sorted(found, key=lambda sf: (sf[0].repo, sf[0].path, sf[1].filename or '', sf[1].lineno or 0))
+
+    @classmethod
+    def Replace(cls, scan, findings):
+        """ the report's findings replace the ones of a previous run/rebuild """
+        with db.atomic(lock_type='IMMEDIATE'):
+            cls.delete().where(cls.scan == scan).execute()
+            cls.Add(scan, findings)
+
+
+def _count_field():
+    # rows inserted by triggers, so the default must be the db's
+    return IntegerField(default=0, constraints=[SQL('DEFAULT 0')])
+
+
+class BatchSummary(BaseModel):
+    """ a batch's progress and final findings, kept by db triggers as its scans change """
+    batch = ForeignKeyField(BatchExec, primary_key=True, backref='summaries')
+    total = _count_field()
+    queued = _count_field()
+    running = _count_field()
+    done = _count_field()
+    failed = _count_field()
+    cancelled = _count_field()
+    findings = _count_field()
+    high = _count_field()
+    medium = _count_field()
+    low = _count_field()
+    enhancement = _count_field()
+
+    # counter -> statuses counted in it
+    Statuses = {
+        'queued': (ScanStatus.Queued,),
+        'running': (ScanStatus.Fetching, ScanStatus.Fetched, ScanStatus.Scanning,
+                    ScanStatus.Scanned, ScanStatus.Processing),
+        'done': (ScanStatus.Done,),
+        'failed': (ScanStatus.Failed,),
+        'cancelled': (ScanStatus.Cancelled,),
+    }
+    # counter -> finding level
+    Levels = {'high': 'High', 'medium': 'Medium', 'low': 'Low', 'enhancement': 'Enhancement'}
+
+    def __str__(self):
+        return f'<B:{self.batch_id} {self.done}/{self.total} done, {self.findings} findings>'
+
+    @property
+    def vulnstats(self) -> PrioritySum:
+        return PrioritySum(**{level: getattr(self, name) for name, level in self.Levels.items()})
+
+    @property
+    def score(self):
+        return self.vulnstats.sum()
+
+    @property
+    def finished(self) -> bool:
+        return self.queued + self.running == 0
+
+    def as_dict(self):
+        return dict({name: getattr(self, name) for name in
+                     ('total', *self.Statuses, 'findings', *self.Levels)},
+                    batch=self.batch_id, score=self.score, finished=self.finished)
+
+    @classmethod
+    def Get(cls, batch_id) -> 'BatchSummary':
+        """ one row read; batches without one (yet) get an empty one """
+        return cls.get_or_none(cls.batch == batch_id) or cls(batch=batch_id)
+
+    @classmethod
+    def Rebuild(cls, *where):
+        """ recount the summaries of the batches matching where (all by default) """
+        batches = BatchExec.select(BatchExec.id).where(*where) if where else BatchExec.select(BatchExec.id)
+        with db.atomic():
+            cls.delete().where(cls.batch.in_(batches)).execute()
+            cls.insert_from(batches, [cls.batch]).execute()
+            for batch_id, status, count in (
+                    ScannerExec.select(ScannerExec.batch, ScannerExec.status, fn.COUNT(ScannerExec.id))
+                    .where(ScannerExec.batch.in_(batches))
+                    .group_by(ScannerExec.batch, ScannerExec.status).tuples()):
+                counts = {'total': count}
+                counts.update({name: count for name, statuses in cls.Statuses.items() if status in statuses})
+                cls.update({getattr(cls, name): getattr(cls, name) + value for name, value in counts.items()}
+                           ).where(cls.batch == batch_id).execute()
+            for batch_id, level, count in (
+                    ScanFinding.select(ScannerExec.batch, ScanFinding.level, fn.COUNT(ScanFinding.id))
+                    .join(ScannerExec)
+                    .where(ScannerExec.batch.in_(batches), ScanFinding.partial == False)
+                    .group_by(ScannerExec.batch, ScanFinding.level).tuples()):
+                counts = {'findings': count}
+                counts.update({name: count for name, name_level in cls.Levels.items() if level == name_level})
+                cls.update({getattr(cls, name): getattr(cls, name) + value for name, value in counts.items()}
+                           ).where(cls.batch == batch_id).execute()
+
+
+def _summary_deltas(row: str, sign: str, counters: dict, column: str) -> str:
+    """ SET clause adding (sign) 1 to counters (name -> values) that row's column is in """
+    return ', '.join(
+        f'{name} = {name} {sign} coalesce({row}.{column} IN ({", ".join(repr(v) for v in values)}), 0)'
+        for name, values in counters.items())
+
+
+def _summary_triggers() -> dict:
+    """ name -> (table, event, condition, statements) keeping BatchSummary """
+    levels = {name: (level,) for name, level in BatchSummary.Levels.items()}
+
+    def scan(row, sign):
+        return (f'UPDATE batchsummary SET total = total {sign} 1, '
+                f'{_summary_deltas(row, sign, BatchSummary.Statuses, "status")} '
+                f'WHERE batch_id = {row}.batch_id;')
+
+    def finding(row, sign):
+        return (f'UPDATE batchsummary SET findings = findings {sign} 1, '
+                f'{_summary_deltas(row, sign, levels, "level")} '
+                f'WHERE batch_id = (SELECT batch_id FROM scannerexec WHERE id = {row}.scan_id);')
+    return {
+        'batchexec_insert_summary': (
+            'batchexec', 'INSERT', None,
+            'INSERT OR IGNORE INTO batchsummary (batch_id) VALUES (NEW.id);'),
+        'batchexec_delete_summary': (
+            'batchexec', 'DELETE', None,
+            'DELETE FROM batchsummary WHERE batch_id = OLD.id;'),
+        'scannerexec_insert_summary': (
+            'scannerexec', 'INSERT', 'NEW.batch_id IS NOT NULL',
+            'INSERT OR IGNORE INTO batchsummary (batch_id) VALUES (NEW.batch_id);' + scan('NEW', '+')),
+        'scannerexec_update_summary': (
+            'scannerexec', 'UPDATE OF status, batch_id',
+            'OLD.status IS NOT NEW.status OR OLD.batch_id IS NOT NEW.batch_id',
+            'INSERT OR IGNORE INTO batchsummary (batch_id) SELECT NEW.batch_id WHERE NEW.batch_id IS NOT NULL;'
+            + scan('OLD', '-') + scan('NEW', '+')),
+        'scannerexec_delete_summary': (
+            'scannerexec', 'DELETE', 'OLD.batch_id IS NOT NULL', scan('OLD', '-')),
+        # partial findings are replaced by the final ones, only those are counted
+        'scanfinding_insert_summary': (
+            'scanfinding', 'INSERT', 'NOT NEW.partial', finding('NEW', '+')),
+        'scanfinding_delete_summary': (
+            'scanfinding', 'DELETE', 'NOT OLD.partial', finding('OLD', '-')),
+    }
+
+
+class RebuildJob(BaseModel):
+    timestamp = DateTimeField(default=datetime.datetime.now)
+    # rebuild every report, not just the stale ones
+    force = BooleanField(default=False)
+    status = CharField(default='queued')
+    total = IntegerField(null=True)
+    done = IntegerField(default=0)
+    failed = IntegerField(default=0)
+    errors = TextField(null=True)
+    finished = DateTimeField(null=True)
+
+    def __str__(self):
+        return f'<{self.id}: {self.status} {self.done}+{self.failed}/{self.total}>'
+
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'timestamp': str(self.timestamp),
+            'force': self.force,
+            'status': self.status,
+            'total': self.total,
+            'done': self.done,
+            'failed': self.failed,
+            'finished': str(self.finished) if self.finished else None,
+        }
+
+
+class CompositeReport(BaseModel):
+    """ BatchExec.composite_report() as of the batch's change_token() """
+    batch = ForeignKeyField(BatchExec, unique=True)
+    token = CharField()
+    # json: [[scan id, finding], ...]
+    content = TextField()
+
+
+class ReportChunk(BaseModel):
+    report = ForeignKeyField(Report, backref='chunks')
+    idx = IntegerField(null=False)
+    data = TextField(null=False)
+
+    class Meta:
+        indexes = ((('report', 'idx'), True),)
+
+
 class Execution(BaseModel):
     scan = ForeignKeyField(ScannerExec, backref='execs', null=True)
     kind = CharField(unique=False, null=False, index=True)
@@ -159,8 +645,16 @@ class Execution(BaseModel):
     wd = CharField(unique=False, null=True)
     env = CharField(unique=False, null=True)
     ret = IntegerField(unique=False, null=True)
-    timestamp = DateTimeField(null=True)
+    timestamp = DateTimeField(null=True, index=True)
     duration = FloatField(null=True)
+    killed = CharField(null=True)
+    # container resources, only known with the docker api backend
+    cpu_seconds = FloatField(null=True)
+    mem_peak = IntegerField(null=True)
+
+    KILLED_TIMEOUT = 'timeout'
+    KILLED_CANCELLED = 'cancelled'
+    KILLED_INTERRUPTED = 'interrupted'
 
     def __str__(self):
         return f'<{self.id}: {self.cmdargs[:30]}  ({self.ret})>'
@@ -174,10 +668,24 @@ class Execution(BaseModel):
             wd=wd,
             env=json.dumps(env))
 
+    # output lines rendered with the page, the others are loaded on demand
+    TAIL_LINES = 200
+
     @property
     def output(self):
         return '\n'.join(ol.line for ol in self.output_line)
 
+    def lines(self, before=None, after=None, limit=TAIL_LINES) -> list:
+        """ up to limit OutputLines (id, is_out, line): the last ones, or the
+            ones right before/after the line with that id """
+        query = (OutputLine.select(OutputLine.id, OutputLine.is_out, OutputLine.line)
+                 .where(OutputLine.execution == self))
+        if after is not None:
+            return list(query.where(OutputLine.id > after).order_by(OutputLine.id).limit(limit))
+        if before is not None:
+            query = query.where(OutputLine.id < before)
+        return list(reversed(query.order_by(OutputLine.id.desc()).limit(limit)))
+
     def set_end(self, retcode):
         end = datetime.datetime.now()
         self.duration = (end - self.timestamp).total_seconds()
@@ -209,6 +717,16 @@ class Execution(BaseModel):
             return 0
         return datetime.datetime.now().timestamp() - self.timestamp.timestamp()
 
+class StageTiming(BaseModel):
+    scan = ForeignKeyField(ScannerExec, backref='timings')
+    stage = CharField(null=False, index=True)
+    start = DateTimeField(default=datetime.datetime.now)
+    duration = FloatField(null=False)
+
+    def __str__(self):
+        return f'<{self.id}: S:{self.scan_id} {self.stage} {self.duration:.2f}s>'
+
+
 class OutputLine(BaseModel):
     execution = ForeignKeyField(Execution, backref='output_line')
     is_out = BooleanField(default=True)
@@ -220,12 +738,130 @@ class OutputLine(BaseModel):
         return OutputLine.create(execution=execution, is_out=is_out, idx=idx, line=line)
 
 
+class FindingSearch(FTS5Model):
+    """ full-text index of ScanFinding (rowid is its id), kept by db triggers """
+    name = SearchField()
+    desc = SearchField()
+    filename = SearchField()
+
+    class Meta:
+        database = db
+        options = {'content': ScanFinding, 'content_rowid': ScanFinding.id}
+
+
+class OutputSearch(FTS5Model):
+    """ full-text index of OutputLine (rowid is its id), kept by db triggers """
+    line = SearchField()
+
+    class Meta:
+        database = db
+        options = {'content': OutputLine, 'content_rowid': OutputLine.id}
+
+
+def _search_triggers() -> dict:
+    """ name -> (table, event, condition, statements) keeping the external content fts tables """
+    triggers = {}
+    for search in (FindingSearch, OutputSearch):
+        fts = search._meta.table_name
+        table = search._meta.options['content']._meta.table_name
+        quoted = [f'"{field.column_name}"' for field in search._meta.sorted_fields
+                  if isinstance(field, SearchField)]
+        columns = ', '.join(quoted)
+
+        def values(row):
+            return ', '.join(f'{row}.{column}' for column in quoted)
+        insert = f'INSERT INTO {fts} (rowid, {columns}) VALUES (NEW.id, {values("NEW")});'
+        delete = (f'INSERT INTO {fts} ({fts}, rowid, {columns}) '
+                  f'VALUES (\'delete\', OLD.id, {values("OLD")});')
+        triggers[f'{table}_insert_{fts}'] = (table, 'INSERT', None, insert)
+        triggers[f'{table}_delete_{fts}'] = (table, 'DELETE', None, delete)
+        triggers[f'{table}_update_{fts}'] = (table, f'UPDATE OF {columns}', None, delete + insert)
+    return triggers
+
+
+class Counter(BaseModel):
+    """ versions bumped by db triggers, to tell cheaply when cached data is stale """
+    name = CharField(primary_key=True)
+    value = IntegerField(default=0)
+
+    # batches and batchless scans (helperfuncs.sidebar)
+    SIDEBAR = 'sidebar'
+
+    @classmethod
+    def Get(cls, name) -> int:
+        return cls.select(cls.value).where(cls.name == name).scalar() or 0
+
+
+# counter -> table -> {event: condition (or None)} bumping it
+COUNTER_TRIGGERS = {
+    Counter.SIDEBAR: {
+        'batchexec': {'INSERT': None, 'UPDATE': None, 'DELETE': None},
+        'scannerexec': {
+            'INSERT': None,
+            'DELETE': None,
+            # status changes of scans in batches happen all the time, and aren't shown
+            'UPDATE': 'NEW.batch_id IS NULL OR OLD.batch_id IS NOT NEW.batch_id',
+        },
+    },
+}
+
+
+def create_triggers():
+    for name, (table, event, condition, statements) in {**_summary_triggers(), **_search_triggers()}.items():
+        when = f'WHEN {condition} ' if condition else ''
+        db.execute_sql(f'CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} FOR EACH ROW {when}'
+                       f'BEGIN {statements} END')
+    for name, tables in COUNTER_TRIGGERS.items():
+        Counter.insert(name=name).on_conflict_ignore().execute()
+        for table, events in tables.items():
+            for event, condition in events.items():
+                when = f'WHEN {condition} ' if condition else ''
+                db.execute_sql(
+                    f'CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_{name} '
+                    f'AFTER {event} ON {table} FOR EACH ROW {when}'
+                    f'BEGIN UPDATE counter SET value = value + 1 WHERE name = \'{name}\'; END')
+
+
+MODELS = [BatchExec, ScannerExec, Report, ReportChunk, ScanFinding, Execution, OutputLine, StageTiming,
+          RebuildJob, CompositeReport, Counter, BatchSummary]
+# fts5 virtual tables, indexing the content of the MODELS above
+SEARCH_MODELS = [FindingSearch, OutputSearch]
+
+
 def init():
     db = SqliteDatabase(DB_FILE)
     # Connect to our database.
     db.connect()
     # Create the tables.
-    db.create_tables([BatchExec, ScannerExec, Report, Execution, OutputLine])
+    db.create_tables(MODELS + SEARCH_MODELS)
+    create_triggers()
+
+
+def upgrade():
+    """Create missing tables and add columns introduced after the db file was created."""
+    from playhouse.migrate import SqliteMigrator, migrate
+    migrator = SqliteMigrator(db)
+    ops = []
+    for klass in MODELS:
+        table = klass._meta.table_name
+        if not db.table_exists(table):
+            continue
+        existing = {column.name for column in db.get_columns(table)}
+        for field in klass._meta.sorted_fields:
+            if field.column_name not in existing:
+                ops.append(migrator.add_column(table, field.column_name, field))
+    if ops:
+        with db.atomic():
+            migrate(*ops)
+    new_summaries = not db.table_exists(BatchSummary._meta.table_name)
+    new_searches = [search for search in SEARCH_MODELS if not db.table_exists(search._meta.table_name)]
+    db.create_tables(MODELS + SEARCH_MODELS)
+    create_triggers()
+    # rows from before the triggers kept them
+    if new_summaries:
+        BatchSummary.Rebuild()
+    for search in new_searches:
+        search.rebuild()
 
 
 if __name__ == '__main__':
@@ -236,6 +872,8 @@ else:
         return file_stats.st_size==0
     if (not os.path.exists(DB_FILE)) or invalid(DB_FILE):
         init()
+    elif os.environ.get('DB_UPGRADE', 'true').lower() == 'true':
+        upgrade()
 
 
 def get_scans():
@@ -245,7 +883,11 @@ def get_scans():
 
 
 def get_batchs():
+    """ with their scan_count """
     return [x for x in
-            BatchExec.select().order_by(BatchExec.timestamp.desc())]
+            BatchExec.select(BatchExec, fn.COUNT(ScannerExec.id).alias('scan_count'))
+            .join(ScannerExec, JOIN.LEFT_OUTER)
+            .group_by(BatchExec.id)
+            .order_by(BatchExec.timestamp.desc())]
 
 
@@ -0,0 +1,191 @@
+"""
+Opt-in profiling (cProfile) of the web requests and of some actors, set up
+by environment, off unless PROFILE_DIR and PROFILE_EVERY or PROFILE_SLOWER
+are set:
+
+    PROFILE_DIR      where the profiles are written (a .prof and a .json each)
+    PROFILE_EVERY    keep the profile of every Nth call of each request
+                     endpoint / actor (0: none)
+    PROFILE_SLOWER   keep the profile of the calls that took more seconds than
+                     this (0: none). All the calls are profiled then, cProfile
+                     makes them slower (2x on pure python code)
+    PROFILE_ACTORS   the actors profiled: the scan stages (fetch_source_task,
+                     run_scanner_task, process_report_task), rebuild_reports_task,
+                     execute_task, execute_batch and generic_task_runner
+    PROFILE_KEEP     profiles kept, the fastest ones are removed (200)
+
+Counting is per process. The slowest profiles are listed on /profiles, each
+can be read there (pstats) or downloaded (snakeviz, `python -m pstats`).
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+from collections import defaultdict
+
+import dramatiq
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_EVERY = int(os.environ.get('PROFILE_EVERY', 0))
+PROFILE_SLOWER = float(os.environ.get('PROFILE_SLOWER', 0))
+PROFILE_ACTORS = os.environ.get('PROFILE_ACTORS', ','.join((
+    'fetch_source_task', 'run_scanner_task', 'process_report_task', 'rebuild_reports_task',
+    'execute_task', 'execute_batch', 'generic_task_runner'))).split(',')
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+
+SORTS = ('cumulative', 'tottime', 'ncalls')
+
+_valid_id = re.compile(r'^[\w.-]+$')
+_calls, _calls_lock = defaultdict(int), threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(PROFILE_DIR) and (PROFILE_EVERY > 0 or PROFILE_SLOWER > 0)
+
+
+def _nth_call(key: str) -> bool:
+    with _calls_lock:
+        _calls[key] += 1
+        return PROFILE_EVERY > 0 and _calls[key] % PROFILE_EVERY == 0
+
+
+class Sample:
+    """ a call being profiled, its profile is kept by stop() if it's a sampled
+        (Nth) or a slow one """
+
+    def __init__(self, kind: str, name: str, detail: str, nth: bool):
+        self.kind, self.name, self.detail, self.nth = kind, name, detail, nth
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        """ the id of the profile written, if it was kept """
+        self.profiler.disable()
+        duration = time.perf_counter() - self.started
+        if not (self.nth or (PROFILE_SLOWER > 0 and duration >= PROFILE_SLOWER)):
+            return None
+        return save(self.profiler, self.kind, self.name, self.detail, duration)
+
+
+def start(kind: str, name: str, detail: str = ''):
+    """ a Sample of this call of name, or None if it isn't profiled """
+    if not enabled():
+        return None
+    nth = _nth_call(f'{kind}:{name}')
+    if not nth and PROFILE_SLOWER <= 0:
+        return None
+    try:
+        return Sample(kind, name, detail, nth)
+    except ValueError:
+        # another profiler is active in this thread
+        return None
+
+
+def _path(profile_id: str, suffix: str) -> str:
+    if not _valid_id.match(profile_id):
+        raise KeyError(profile_id)
+    return os.path.join(PROFILE_DIR, profile_id + suffix)
+
+
+def save(profiler: cProfile.Profile, kind: str, name: str, detail: str, duration: float) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profile_id = '-'.join((kind, re.sub(r'[^\w.]+', '_', name)[:60],
+                           str(int(time.time() * 1000)), str(os.getpid()), str(threading.get_ident())))
+    profiler.dump_stats(_path(profile_id, '.prof'))
+    info = {'id': profile_id, 'kind': kind, 'name': name, 'detail': detail,
+            'duration': duration, 'timestamp': time.time(), 'pid': os.getpid()}
+    # the .json last: the profiles listed are complete
+    with open(_path(profile_id, '.json.tmp'), 'w') as f:
+        json.dump(info, f)
+    os.replace(_path(profile_id, '.json.tmp'), _path(profile_id, '.json'))
+    prune()
+    return profile_id
+
+
+def profiles(limit: int = None) -> list:
+    """ the profiles' info, slowest first """
+    if not PROFILE_DIR or not os.path.isdir(PROFILE_DIR):
+        return []
+    found = []
+    for filename in os.listdir(PROFILE_DIR):
+        if filename.endswith('.json'):
+            try:
+                with open(os.path.join(PROFILE_DIR, filename)) as f:
+                    found.append(json.load(f))
+            except (OSError, ValueError):
+                # removed meanwhile (by prune() of another process)
+                pass
+    found.sort(key=lambda info: info['duration'], reverse=True)
+    return found[:limit]
+
+
+def prune():
+    """ removes the fastest profiles over PROFILE_KEEP """
+    for info in profiles()[PROFILE_KEEP:]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(_path(info['id'], suffix))
+            except FileNotFoundError:
+                pass
+
+
+def get(profile_id: str) -> dict:
+    with open(_path(profile_id, '.json')) as f:
+        return json.load(f)
+
+
+def prof_path(profile_id: str) -> str:
+    return _path(profile_id, '.prof')
+
+
+def stats(profile_id: str, sort: str = 'cumulative', limit: int = 80) -> str:
+    """ pstats' report of the profile, its limit most expensive functions by sort """
+    out = io.StringIO()
+    report = pstats.Stats(prof_path(profile_id), stream=out)
+    report.strip_dirs().sort_stats(sort if sort in SORTS else SORTS[0]).print_stats(limit)
+    return out.getvalue()
+
+
+def init_app(app):
+    """ profiles the app's requests (but /profiles) """
+    from flask import g, request
+
+    @app.before_request
+    def profile_start():
+        if request.endpoint and not request.endpoint.startswith('profile'):
+            g.profile = start('request', request.endpoint, f'{request.method} {request.full_path}')
+
+    @app.teardown_request
+    def profile_stop(exc):
+        sample = g.pop('profile', None)
+        if sample is not None:
+            sample.stop()
+
+
+class ActorProfiler(dramatiq.Middleware):
+    """ profiles the messages of PROFILE_ACTORS, in the worker thread processing them """
+
+    def __init__(self):
+        self.samples = threading.local()
+
+    def before_process_message(self, broker, message):
+        if message.actor_name in PROFILE_ACTORS:
+            self.samples.current = start('actor', message.actor_name, f'{message.actor_name}{message.args}')
+
+    def after_process_message(self, broker, message, *, result=None, exception=None):
+        sample, self.samples.current = getattr(self.samples, 'current', None), None
+        if sample is not None:
+            sample.stop()
+
+    after_skip_message = after_process_message
+
+
+def add_middleware(broker):
+    """ adds the ActorProfiler to broker, if enabled and it hasn't got it """
+    if enabled() and not any(isinstance(m, ActorProfiler) for m in broker.middleware):
+        broker.add_middleware(ActorProfiler())
@@ -1,4 +1,6 @@
+import hashlib
 import json
+import posixpath
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional, List, Union
@@ -6,6 +8,11 @@ from typing import Optional, List, Union
 import json
 from enum import Enum
 
+# on-disk format of the reports (ResultsReport.to_json):
+#   1: findings' jsonextra is a json string inside the json
+#   2: jsonextra is structured, SpanObjects without text have no 'text' key
+REPORT_FORMAT = 2
+
 
 class Priority(str, Enum):
     High = 'High'
@@ -46,11 +53,46 @@ class Priority(str, Enum):
                 return "Enhancement"
         raise ValueError(f"Invalid priority string: {self}")
 
-@dataclass
+@dataclass(slots=True)
 class Scanner:
     name: str
 
-@dataclass
+
+def normalise_path(path: Optional[str]) -> str:
+    """ the same file gets the same path whatever checkout/mount point it was scanned from """
+    if not path:
+        return ''
+    path = path.replace('\\', '/')
+    if '/srcs/' in path:
+        path = path.split('/srcs/', 1)[1]
+    return posixpath.normpath(path).lstrip('/')
+
+
+def span_location(jsonextra, lineno) -> str:
+    """ the first span's text if the scanner gave it (survives lines moving around),
+        its location otherwise """
+    if isinstance(jsonextra, str):
+        try:
+            jsonextra = json.loads(jsonextra)
+        except ValueError:
+            jsonextra = None
+    spans = jsonextra.get('spans') if isinstance(jsonextra, dict) else None
+    if not spans:
+        return str(lineno)
+    span = spans[0]
+    if span.get('text'):
+        return ' '.join(span['text'].split())
+    return f"{span.get('line_start')}:{span.get('column_start')}-{span.get('line_end')}:{span.get('column_end')}"
+
+
+def fingerprint(scanner: str, code: str, filename: str, lineno: int, jsonextra) -> str:
+    """ identity of a finding across scans """
+    key = '\0'.join([scanner or '', code or '', normalise_path(filename),
+                     span_location(jsonextra, lineno)])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+@dataclass(slots=True)
 class Finding:
     name: str
     category: str
@@ -58,9 +100,15 @@ class Finding:
     filename: str
     lineno: int
     scanner: Scanner
-    jsonextra: str
+    # {'spans': [SpanObject.as_dict()..], 'extra': SrcExtra.as_dict()} for scout
+    jsonextra: Optional[dict]
     desc: Optional[str]=''
 
+    @property
+    def fingerprint(self) -> str:
+        return fingerprint(self.scanner.name if self.scanner is not None else '',
+                           self.name, self.filename, self.lineno, self.jsonextra)
+
     def as_dict(self):
         return {
             'name': self.name,
@@ -71,9 +119,18 @@ class Finding:
             'lineno': self.lineno,
             'jsonextra': self.jsonextra,
             'scanner': self.scanner.name if self.scanner is not None else '',
+            'fingerprint': self.fingerprint,
         }
 
-@dataclass
+def finding_extra(finding: dict) -> dict:
+    """ a stored finding's jsonextra, whatever the format of its report """
+    extra = finding.get('jsonextra')
+    if isinstance(extra, str):
+        extra = finding['jsonextra'] = json.loads(extra) if extra else {}
+    return extra or {}
+
+
+@dataclass(slots=True)
 class ResultsReport:
     name: str
     date: datetime
@@ -101,7 +158,8 @@ class ResultsReport:
                             if self.findings is not None else []}
 
     def as_dict_ex(self):
-        x = {'name': self.name,
+        x = {'format': REPORT_FORMAT,
+                'name': self.name,
                 'date': str(self.date),
                 'issuer': self.issuer,
                 'scanners': [s for s in self.scanners] if self.scanners else self.scanners,
@@ -112,10 +170,11 @@ class ResultsReport:
         return x
 
     def to_json(self, indent=None):
-        return json.dumps(self.as_dict_ex(), indent=indent)
+        separators = None if indent is not None else (',', ':')
+        return json.dumps(self.as_dict_ex(), indent=indent, separators=separators)
 
 
-@dataclass
+@dataclass(slots=True)
 class SpanObject:
     byte_end: int
     byte_start: int
@@ -124,13 +183,22 @@ class SpanObject:
     line_end: int
     line_start: int
     file_name: str
+    # the highlighted source, if the scanner gave it
+    text: Optional[str] = None
 
     @classmethod
     def FromJsonObj(cls, json_obj):
         return cls(byte_end=json_obj['byte_end'], byte_start=json_obj['byte_start'],
                    column_end=json_obj['column_end'], column_start=json_obj['column_start'],
                    line_end=json_obj['line_end'], line_start=json_obj['line_start'],
-                   file_name=json_obj['file_name'])
+                   file_name=json_obj['file_name'], text=cls.HighlightedText(json_obj))
+
+    @staticmethod
+    def HighlightedText(json_obj) -> Optional[str]:
+        """ rustc's span text: source lines with the highlighted columns (1-based) """
+        lines = [t['text'][t['highlight_start']-1:t['highlight_end']-1]
+                 for t in json_obj.get('text') or [] if 'text' in t]
+        return '\n'.join(lines) or None
 
     def as_dict(self):
         return {
@@ -140,11 +208,12 @@ class SpanObject:
             'column_start': self.column_start,
             'line_end': self.line_end,
             'line_start': self.line_start,
-            'file_name': self.file_name
+            'file_name': self.file_name,
+            **({'text': self.text} if self.text is not None else {}),
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class SrcExtra:
     filename: str
     manifest: str
@@ -1,33 +1,58 @@
-import json
 import os
 import sys
 from dataclasses import dataclass
+from functools import lru_cache
 import traceback
 from typing import List
 
 import json5
 import semver
 
-from drunner import ScannerRunner
+try:
+    from orjson import loads as strict_loads
+except ImportError:
+    from json import loads as strict_loads
+
+from drunner import ScannerRunner, CHECKOUT_TIMEOUT
 from model import ScannerExec
 from results import ResultsReport, Finding, Priority, Scanner, SpanObject, SrcExtra
 
 ScoutCodeCategories = {}
 
 
+def loads(line):
+    """ strict json is way faster, json5 is only used for the lines it rejects """
+    try:
+        return strict_loads(line)
+    except ValueError:
+        return json5.loads(line.decode('utf-8') if isinstance(line, bytes) else line)
+
+
+@lru_cache
+def parse_version(version: str) -> semver.Version:
+    return semver.Version.parse(version)
+
+
 class ScoutRunner(ScannerRunner):
     IMAGE = 'coinfabrik/scout:latest'
     CONTAINER_RAW_REPORT_NAME = os.path.join(ScannerRunner.OUTPUT_DIR_NAME, 'report.json')
+    MOUNT_POINT = '/scoutme'
+    PARSER_VERSION = 3
     _version = None
 
     def _get_version(self):
         if self.m.scanner_version is None:
-            ex = self.exec('run-get-version',
-                           [f'docker run -i --rm -e INPUT_SCOUT_ARGS=--version {self.IMAGE}'])
-            self.m.scanner_version = ex.scan.scanner_version = self._version = ex.output
-            ex.scan.save()
+            ex = self.run_container('run-get-version', {'INPUT_SCOUT_ARGS': '--version'},
+                                    mount=False, timeout=CHECKOUT_TIMEOUT)
+            self.check_exec(ex)
+            self.m.scanner_version = self._version = ex.output
+            self.m.save(only=[ScannerExec.scanner_version])
         self._version = self.m.scanner_version
 
+    def scanner_version(self):
+        self._get_version()
+        return self.m.scanner_version
+
     @property
     def version(self):
         if self._version is None:
@@ -51,21 +76,29 @@ class ScoutRunner(ScannerRunner):
     def run_image(self):
         self._get_version()
         env = {
-            'INPUT_TARGET': f'/scoutme/srcs/{self.path}',
+            'INPUT_TARGET': f'{self.MOUNT_POINT}/srcs/{self.path}',
             'RUST_BACKTRACE': 'full',
-            'INPUT_SCOUT_ARGS': self.get_format() + f" -v --output-path /scoutme/{self.CONTAINER_RAW_REPORT_NAME}",
+            'INPUT_SCOUT_ARGS': self.get_format() + f" -v --output-path {self.MOUNT_POINT}/{self.CONTAINER_RAW_REPORT_NAME}",
             'CARGO_TARGET_DIR': '/tmp',
         }
-        envs = ' '.join(f'-e {key}="{value}"' for key, value in env.items())
-        cmd = (f'docker run -i --rm {envs} -v {self.tmpdir}:/scoutme {self.IMAGE}')
-        self.exec('run-image', [cmd])
+        return self.run_container('run-image', env)
+
+    def line_parser(self):
+        parse = ScoutVulnerability.LineParser(self.version)
+
+        def parse_finding(line):
+            sv = parse(line)
+            return None if sv is None else sv.asFinding()
+        return parse_finding
 
     def _get_vulns_from_raw_report(self, raw_report):
         version = self.version
-        for line in raw_report.splitlines():
+        parse = ScoutVulnerability.LineParser(version)
+        if isinstance(raw_report, (str, bytes)):
+            raw_report = raw_report.splitlines()
+        for line in raw_report:
             try:
-                msg = json5.loads(line)
-                sv = ScoutVulnerability.FromJsonObj(version, msg)
+                sv = parse(line)
                 if sv is None: continue
                 yield sv.asFinding()
             except Exception as err:
@@ -89,7 +122,7 @@ class ScoutRunner(ScannerRunner):
 ScannerRunner.Register(ScoutRunner, 'scout')
 
 
-@dataclass
+@dataclass(slots=True)
 class ScoutVulnerability:
     message: str
     code: str
@@ -112,20 +145,35 @@ class ScoutVulnerability:
             filename=self.src_path,
             lineno=self.src_line,
             scanner=Scanner('scout'),
-            jsonextra=json.dumps({
+            jsonextra={
                 'spans': [s.as_dict() for s in self.spans],
                 'extra': self.src_extra.as_dict()
-            })
+            }
         )
 
     @classmethod
     def FromJsonObj(cls, version: str, json_obj: dict):
-        version = semver.Version.parse(version)
-        v0216 = semver.Version.parse('0.2.16')
-        if version<v0216:
+        if parse_version(version)<parse_version('0.2.16'):
             return cls.FromJsonObjOriginal(json_obj)
         return cls.FromJsonObj0216(json_obj)
 
+    @classmethod
+    def LineParser(cls, version: str):
+        """ picks the version's format once for a whole report,
+            returns: line -> ScoutVulnerability or None """
+        if parse_version(version)<parse_version('0.2.16'):
+            from_json, marker = cls.FromJsonObjOriginal, 'compiler-message'
+        else:
+            from_json, marker = cls.FromJsonObj0216, 'diagnostic'
+        markers = {str: marker, bytes: marker.encode()}
+
+        def parse(line):
+            # most lines aren't diagnostics (ie: compiler-artifact), skip them unparsed
+            if markers[type(line)] not in line:
+                return None
+            return from_json(loads(line))
+        return parse
+
     @classmethod
     def FromJsonObjOriginal(cls, json_obj):
         if ((not json_obj['reason'] == 'compiler-message') or
@@ -168,8 +216,8 @@ if __name__=="__main__":
     scan = ScannerExec.get_by_id(14)
     sr = ScoutRunner(scan)
     rr = scan.get_raw_report()
-    for v in ScoutRunner._get_vulns_from_raw_report(rr.content):
+    for v in sr._get_vulns_from_raw_report(rr.lines()):
         print(v)
-    rep = sr.process_report(rr.content)
+    rep = sr.process_report(rr.lines())
     print(rr)
 
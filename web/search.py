@@ -0,0 +1,94 @@
+"""
+Full-text search of the findings (name, description, filename) and of the
+executions' output, over the fts5 indexes kept by model's triggers.
+
+Every word of a query must match, "quoted words" as a phrase, a trailing *
+matches a prefix: `unwrap "integer overflow" lib*`. Hits are best first.
+"""
+import re
+
+from markupsafe import Markup, escape
+from peewee import fn
+
+from model import ScannerExec, ScanFinding, Execution, OutputLine, FindingSearch, OutputSearch
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+# words of context around the matches in snippets
+SNIPPET_WORDS = 16
+# around the matched words in snippets, see marked()
+MARK_START, MARK_END = '\x02', '\x03'
+
+KINDS = ('findings', 'output')
+
+_words = re.compile(r'"([^"]*)"|(\S+)')
+
+
+class SearchError(ValueError):
+    pass
+
+
+def match_expression(query: str) -> str:
+    """ fts5 MATCH expression of a user's query, its words taken literally """
+    terms = []
+    for phrase, word in _words.findall(query):
+        prefix = False
+        if word:
+            prefix, phrase = word.endswith('*') and len(word) > 1, word.rstrip('*')
+        if phrase.strip():
+            terms.append('"%s"%s' % (phrase.replace('"', '""'), '*' if prefix else ''))
+    if not terms:
+        raise SearchError('Nothing to search for')
+    return ' '.join(terms)
+
+
+def _limit(limit) -> int:
+    return max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+
+
+def _snippet(search, column: int, marks: bool):
+    start, end = (MARK_START, MARK_END) if marks else ('', '')
+    return fn.snippet(search._meta.entity, column, start, end, '…', SNIPPET_WORDS)
+
+
+def findings(query: str, limit=DEFAULT_LIMIT, batch=None, marks=False) -> list:
+    """ dicts of the findings matching query (of that batch), with snippets of their
+        name and description """
+    search = (FindingSearch
+              .select(ScanFinding.id, ScanFinding.scan, ScannerExec.batch, ScannerExec.repo,
+                      ScannerExec.path, ScanFinding.scanner, ScanFinding.level, ScanFinding.filename,
+                      ScanFinding.lineno, ScanFinding.partial,
+                      _snippet(FindingSearch, 0, marks).alias('name'),
+                      _snippet(FindingSearch, 1, marks).alias('desc'),
+                      FindingSearch.rank().alias('rank'))
+              .join(ScanFinding, on=(FindingSearch.rowid == ScanFinding.id))
+              .join(ScannerExec)
+              .where(FindingSearch.match(match_expression(query)))
+              .order_by(FindingSearch.rank())
+              .limit(_limit(limit)))
+    if batch is not None:
+        search = search.where(ScannerExec.batch == batch)
+    return list(search.dicts())
+
+
+def output(query: str, limit=DEFAULT_LIMIT, scan=None, marks=False) -> list:
+    """ dicts of the output lines matching query (of that scan's executions) """
+    search = (OutputSearch
+              .select(OutputLine.id, OutputLine.execution, Execution.scan, Execution.kind,
+                      OutputLine.is_out,
+                      _snippet(OutputSearch, 0, marks).alias('line'),
+                      OutputSearch.rank().alias('rank'))
+              .join(OutputLine, on=(OutputSearch.rowid == OutputLine.id))
+              .join(Execution)
+              .where(OutputSearch.match(match_expression(query)))
+              .order_by(OutputSearch.rank())
+              .limit(_limit(limit)))
+    if scan is not None:
+        search = search.where(Execution.scan == scan)
+    return list(search.dicts())
+
+
+def marked(text: str) -> Markup:
+    """ html of a snippet searched with marks, the matches in <mark> """
+    return Markup(str(escape(text or ''))
+                  .replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
@@ -0,0 +1,113 @@
+"""
+Batch definitions: the create form's `repo,commit,path,scanner` lines, or an
+uploaded csv (the same columns, optionally with that header) or ndjson file
+({"repo": .., "commit": .., "path": .., "scanner": ..} per line).
+
+Everything is checked before anything is created: a batch with a bad
+definition gets all its errors back, and no scan.
+"""
+import csv
+import io
+import json
+import os
+
+from errors import UnknownScanner
+
+COLUMNS = ('repo', 'commit', 'path', 'scanner')
+DEFAULTS = {'commit': 'main', 'path': '.', 'scanner': 'scout'}
+MAX_TASKS = int(os.environ.get('MAX_BATCH_TASKS', 20000))
+# errors reported back at most
+MAX_ERRORS = 20
+
+
+class SubmitError(ValueError):
+    def __init__(self, errors):
+        shown = errors[:MAX_ERRORS]
+        if len(errors) > MAX_ERRORS:
+            shown.append(f'... and {len(errors) - MAX_ERRORS} more')
+        super().__init__('\n'.join(shown))
+        self.errors = errors
+
+
+def _task(values: dict) -> dict:
+    return {k: (values.get(k) or '').strip() or DEFAULTS.get(k, '') for k in COLUMNS}
+
+
+def from_lines(lines) -> list:
+    """ (line number, values) of repo,commit,path,scanner lines, the blank ones skipped """
+    rows, reader = [], csv.reader(lines)
+    for row in reader:
+        lineno = reader.line_num
+        if not row or not row[0].strip():
+            continue
+        if lineno == 1 and [c.strip().lower() for c in row] == list(COLUMNS[:len(row)]):
+            continue
+        rows.append((lineno, dict(zip(COLUMNS, row)) if len(row) <= len(COLUMNS) else row))
+    return rows
+
+
+def from_ndjson(lines) -> list:
+    rows = []
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            values = json.loads(line)
+        except ValueError as err:
+            values = f'invalid json: {err}'
+        rows.append((lineno, values))
+    return rows
+
+
+def parse(text: str, filename: str = '') -> list:
+    """ (line number, values) of a definitions text or file """
+    lines = text.splitlines()
+    first = next((line.lstrip() for line in lines if line.strip()), '')
+    if filename.endswith(('.ndjson', '.jsonl')) or first.startswith('{'):
+        return from_ndjson(lines)
+    return from_lines(lines)
+
+
+def validate(rows, known_scanner) -> list:
+    """ the tasks of the rows (see parse), known_scanner(name) raises UnknownScanner for
+        the unknown ones; SubmitError with all that is wrong otherwise """
+    tasks, errors = [], []
+    if len(rows) > MAX_TASKS:
+        raise SubmitError([f'{len(rows)} definitions, at most {MAX_TASKS} are allowed'])
+    for lineno, values in rows:
+        if isinstance(values, str):
+            errors.append(f'line {lineno}: {values}')
+            continue
+        if not isinstance(values, dict):
+            errors.append(f'line {lineno}: expected {",".join(COLUMNS)}')
+            continue
+        unknown = set(values) - set(COLUMNS)
+        if unknown:
+            errors.append(f'line {lineno}: unknown fields {", ".join(sorted(unknown))}')
+            continue
+        if not all(isinstance(v, str) or v is None for v in values.values()):
+            errors.append(f'line {lineno}: values must be strings')
+            continue
+        task = _task(values)
+        if not task['repo'] or any(c.isspace() for c in task['repo']):
+            errors.append(f'line {lineno}: invalid repo {task["repo"]!r}')
+            continue
+        try:
+            known_scanner(task['scanner'])
+        except UnknownScanner as err:
+            errors.append(f'line {lineno}: {err}')
+            continue
+        tasks.append(task)
+    if errors:
+        raise SubmitError(errors)
+    if not tasks:
+        raise SubmitError(['no definitions'])
+    return tasks
+
+
+def read_upload(storage) -> str:
+    """ the text of an uploaded file (werkzeug FileStorage) """
+    try:
+        return io.TextIOWrapper(storage.stream, encoding='utf-8-sig').read()
+    except UnicodeDecodeError:
+        raise SubmitError([f'{storage.filename}: not utf-8 text'])
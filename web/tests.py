@@ -1,19 +1,40 @@
+import cProfile
+import csv
+import datetime
+import gzip
+import io
 import json
 import os
+import subprocess
 import sys
+import tempfile
+import time
 import unittest
+import unittest.mock
 
+import dramatiq
 import json5
 import semver
+from dramatiq.brokers.stub import StubBroker
 
 from web.scout import ScoutVulnerability
 
 os.environ['DB_NAME'] = 'drunner.test.sqlite.db'
 
+import drunner
 from drunner import ScannerRunner
+import dockerapi
+import errors
+import export
+import helperfuncs
 import model
-from results import Priority
-from app import get_app
+import worker
+import results
+import profiling
+import search
+from bench import compare as bench_compare, e2e as bench_e2e, output as bench_output, reports as bench_reports, suite as bench_suite
+from results import Priority, Finding, Scanner, ResultsReport
+from app import get_app, create_app
 
 
 class TestPriorities(unittest.TestCase):
@@ -211,6 +232,846 @@ class RawReportPre0216(unittest.TestCase):
         self.assertEqual(vuln.level, "warning")
 
 
+class TestLineParser(unittest.TestCase):
+    PRE = json.dumps(json5.loads(RawReportPre0216.RAW_LINE_BASIC_v0216_pre_TEST))
+    POST = json.dumps(json5.loads(RawReportPre0216.RAW_LINE_BASIC_from_v0216_TEST))
+
+    def test_parser_per_version(self):
+        self.assertEqual(ScoutVulnerability.LineParser('0.2.14')(self.PRE).level, 'warning')
+        self.assertEqual(ScoutVulnerability.LineParser('0.2.16')(self.POST).code, 'avoid_core_mem_forget')
+        self.assertEqual(ScoutVulnerability.LineParser('0.3.0')(self.POST.encode()).level, 'warning')
+
+    def test_not_diagnostics_are_skipped(self):
+        parse = ScoutVulnerability.LineParser('0.2.16')
+        self.assertIsNone(parse('{"reason":"compiler-artifact", broken json'))
+        self.assertIsNone(parse(''))
+
+    def test_json5_fallback(self):
+        line = self.POST[:-1] + ',}'  # trailing comma: not strict json
+        self.assertEqual(ScoutVulnerability.LineParser('0.2.16')(line).code, 'avoid_core_mem_forget')
+
+
+class TestReportFormat(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_structured_jsonextra(self):
+        finding = ScoutVulnerability.LineParser('0.2.16')(TestLineParser.POST).asFinding()
+        self.assertEqual(finding.jsonextra['spans'][0]['text'], 'core::mem::forget(n)')
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        report = ResultsReport(name='r', date=None, composite=False, scanners=['scout'])
+        report.addFinding(finding)
+        stored = model.Report.Create(docker=dr.m, is_raw=False, content=report.to_json())
+        self.assertEqual(stored.format, results.REPORT_FORMAT)
+        self.assertEqual(stored.findings[0]['jsonextra'], finding.jsonextra)
+        model.ScanFinding.Add(dr.m, stored.findings)
+        self.assertEqual(dr.m.findings.get().jsonextra, finding.jsonextra)
+
+    def test_format_1(self):
+        old = {'name': 'x', 'level': 'Low', 'scanner': 'test', 'filename': 'a.rs', 'lineno': 1,
+               'jsonextra': json.dumps({'spans': []})}
+        self.assertEqual(results.finding_extra(old), {'spans': []})
+        self.assertEqual(results.finding_extra({'jsonextra': ''}), {})
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        stored = model.Report.Create(docker=dr.m, is_raw=False, content=json.dumps({'findings': [old]}))
+        self.assertEqual(stored.findings[0]['jsonextra'], {'spans': []})
+        model.ScanFinding.Add(dr.m, stored.findings)
+        self.assertEqual(dr.m.findings.get().jsonextra, {'spans': []})
+
+
+class TestChunkedReport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_roundtrip(self):
+        content = ''.join(f'{{"line": {i}, "text": "{"x"*(i % 7)}"}}\n' for i in range(1000)) + 'last'
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write(content)
+            f.flush()
+            prev, model.Report.CHUNK_SIZE = model.Report.CHUNK_SIZE, 100
+            try:
+                report = model.Report.CreateFromFile(dr.m, True, f.name)
+            finally:
+                model.Report.CHUNK_SIZE = prev
+        self.assertGreater(report.chunks.count(), 100)
+        self.assertEqual(report.text, content)
+        self.assertEqual(list(report.lines()), content.splitlines())
+        other = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        self.assertEqual(report.copy_to(other.m).text, content)
+
+
+class TestTailFindings(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_findings_while_running(self):
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        dr.TAIL_INTERVAL = 0.05
+        dr.line_parser = lambda: lambda line: Finding(
+            name=line.decode(), category='c', level='Low', filename='f.rs', lineno=1,
+            scanner=Scanner('test'), jsonextra={}) if line.startswith(b'vuln') else None
+        with tempfile.TemporaryDirectory() as dr.tmpdir:
+            os.mkdir(os.path.join(dr.tmpdir, dr.OUTPUT_DIR_NAME))
+            with dr.tail_findings():
+                with open(dr.raw_output_fname, 'wb') as f:
+                    f.write(b'noise\nvuln1\nvu')
+                    f.flush()
+                    time.sleep(0.3)
+                    self.assertEqual([f['name'] for f in dr.m.partial_findings()], ['vuln1'])
+                    f.write(b'ln2\n')
+        self.assertEqual([f['name'] for f in dr.m.partial_findings()], ['vuln1', 'vuln2'])
+        report = dr.process_report([])
+        dr.store_report(report)
+        self.assertEqual(dr.m.partial_findings(), [])
+        self.assertEqual(dr.m.findings.count(), report.finding_count)
+
+
+def make_local_repo(dirname):
+    """ git repo usable as a `file://` scan target, without network access """
+    os.makedirs(os.path.join(dirname, 'contract'))
+    with open(os.path.join(dirname, 'contract', 'Cargo.toml'), 'w') as f:
+        f.write('[package]\nname = "contract"\n')
+    with open(os.path.join(dirname, 'README'), 'w') as f:
+        f.write('test repo\n')
+    for cmd in (['git', 'init', '-q', '-b', 'main'], ['git', 'add', '.'],
+                ['git', '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-m', 'init']):
+        subprocess.run(cmd, cwd=dirname, check=True)
+    return 'file://' + dirname
+
+
+class TestStages(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+        cls.repodir = tempfile.TemporaryDirectory(prefix='drunner-test-repo-')
+        cls.repo = make_local_repo(cls.repodir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.repodir.cleanup()
+
+    def test_fetch_stage_keeps_workdir(self):
+        dr = ScannerRunner.Create(self.repo, 'main', 'contract', scanner='test')
+        self.assertTrue(ScannerRunner.RunStage(dr.m.id, 'fetch_source'))
+        scan = model.ScannerExec.get_by_id(dr.m.id)
+        self.assertEqual(scan.status, model.ScanStatus.Fetched)
+        self.assertIsNotNone(scan.rev_hash)
+        self.assertTrue(os.path.isdir(os.path.join(scan.workdir, 'srcs', 'contract')))
+        ScannerRunner.FromId(dr.m.id).close_workdir()
+
+    def test_stage_timings(self):
+        dr = ScannerRunner.Create(self.repo, 'main', 'contract', scanner='test')
+        ScannerRunner.RunStage(dr.m.id, 'fetch_source')
+        stages = {t.stage for t in model.ScannerExec.get_by_id(dr.m.id).timings}
+        self.assertEqual(stages, {'wait_fetch', 'clone', 'checkout'})
+        ScannerRunner.FromId(dr.m.id).close_workdir()
+        ret = get_app().test_client().get('/metrics')
+        self.assertEqual(ret.status_code, 200)
+        self.assertIn(b'drunner_stage_duration_seconds_bucket{stage="clone",le="+Inf"}', ret.data)
+        self.assertIn(b'drunner_queue_depth{queue="scan"}', ret.data)
+
+    def test_failed_stage_stops_pipeline(self):
+        dr = ScannerRunner.Create(self.repo, 'main', 'contract', scanner='test')
+        # there is no raw report to process yet
+        self.assertFalse(ScannerRunner.RunStage(dr.m.id, 'build_report'))
+        scan = model.ScannerExec.get_by_id(dr.m.id)
+        self.assertEqual(scan.status, model.ScanStatus.Failed)
+        self.assertIsNotNone(scan.errors)
+        self.assertIsNone(scan.workdir)
+        self.assertFalse(ScannerRunner.RunStage(dr.m.id, 'run_scanner'))
+
+    def test_cancel_removes_workdir(self):
+        dr = ScannerRunner.Create(self.repo, 'main', 'contract', scanner='test')
+        self.assertTrue(ScannerRunner.RunStage(dr.m.id, 'fetch_source'))
+        runner = ScannerRunner.FromId(dr.m.id)
+        workdir = runner.m.workdir
+
+        def cancelled_scan():
+            model.ScanFinding.Add(runner.m, [TestFingerprints.finding().as_dict()], partial=True)
+            model.ScannerExec.Cancel(model.ScannerExec.id == runner.m.id)
+            runner.check_exec(runner.exec('scan', ['sleep 60']))
+        runner.run_scanner = cancelled_scan
+        self.assertFalse(runner.run_stage('run_scanner'))
+        self.assertFalse(os.path.isdir(workdir))
+        self.assertIsNone(model.ScannerExec.get_by_id(dr.m.id).workdir)
+        # no findings "so far" of a scan that won't have a report
+        self.assertEqual(runner.m.findings.count(), 0)
+        self.assertNotIn('Findings so far', get_app().test_client().get(f'/scan-exec/{dr.m.id}').text)
+
+    def test_cancel_between_stages_removes_workdir(self):
+        dr = ScannerRunner.Create(self.repo, 'main', 'contract', scanner='test')
+        self.assertTrue(ScannerRunner.RunStage(dr.m.id, 'fetch_source'))
+        workdir = model.ScannerExec.get_by_id(dr.m.id).workdir
+        model.ScannerExec.Cancel(model.ScannerExec.id == dr.m.id)
+        self.assertFalse(ScannerRunner.RunStage(dr.m.id, 'run_scanner'))
+        self.assertFalse(os.path.isdir(workdir))
+        self.assertEqual(model.ScannerExec.get_by_id(dr.m.id).status, model.ScanStatus.Cancelled)
+
+
+class TestIncremental(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def setUp(self):
+        self.repodir = tempfile.TemporaryDirectory(prefix='drunner-test-repo-')
+        self.repo = make_local_repo(self.repodir.name)
+        self.batch = model.BatchExec.create(name='incremental', incremental=True)
+
+    def tearDown(self):
+        self.repodir.cleanup()
+
+    def commit(self, fname):
+        with open(os.path.join(self.repodir.name, fname), 'a') as f:
+            f.write('// changed\n')
+        subprocess.run(['git', '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-am', 'x'],
+                       cwd=self.repodir.name, check=True)
+
+    def scanned(self):
+        """ a finished scan of the current HEAD """
+        dr = ScannerRunner.Create(self.repo, 'main', 'contract', scanner='test')
+        self.assertTrue(dr.run_stage('fetch_source'))
+        dr.m.set_status(model.ScanStatus.Done)
+        model.Report.Create(dr.m, True, 'raw')
+        model.Report.Create(dr.m, False, '{"findings": []}')
+        dr.close_workdir()
+        return dr.m
+
+    def rescan(self):
+        m = model.ScannerExec.create(batch=self.batch, repo=self.repo, commit='main',
+                                     path='contract', scanner='test')
+        ScannerRunner.RunStage(m.id, 'fetch_source')
+        return model.ScannerExec.get_by_id(m.id)
+
+    def test_unchanged_path_is_carried_over(self):
+        previous = self.scanned()
+        self.commit('README')
+        m = self.rescan()
+        self.assertEqual(m.status, model.ScanStatus.Done)
+        self.assertEqual(m.carried_from_id, previous.id)
+        self.assertEqual(m.get_common_report().content, '{"findings": []}')
+        self.assertEqual(m.get_raw_report().carried_from_id, previous.get_raw_report().id)
+
+    def test_carried_over_findings(self):
+        previous = self.scanned()
+        model.ScanFinding.Add(previous, [TestFingerprints.finding().as_dict()])
+        model.ScanFinding.Add(previous, [TestFingerprints.finding(name='so far').as_dict()], partial=True)
+        self.commit('README')
+        m = self.rescan()
+        self.assertEqual(m.carried_from_id, previous.id)
+        self.assertEqual([(f.name, f.partial) for f in m.findings], [('vuln', False)])
+
+    def test_changed_path_is_scanned(self):
+        self.scanned()
+        self.commit('contract/Cargo.toml')
+        m = self.rescan()
+        self.assertEqual(m.status, model.ScanStatus.Fetched)
+        self.assertIsNone(m.carried_from_id)
+        ScannerRunner.GetForExec(m).close_workdir()
+
+
+class TestFingerprints(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    @staticmethod
+    def finding(name='vuln', filename='src/lib.rs', lineno=10, text='a.unwrap()'):
+        span = {'line_start': lineno, 'column_start': 5, 'line_end': lineno, 'column_end': 15,
+                'text': text}
+        return Finding(name=name, category='c', level='Low', filename=filename, lineno=lineno,
+                       scanner=Scanner('test'), jsonextra=json.dumps({'spans': [span]}))
+
+    def test_stable_across_moves_and_checkouts(self):
+        fp = self.finding().fingerprint
+        self.assertEqual(self.finding(lineno=42).fingerprint, fp)
+        self.assertEqual(self.finding(filename='/scoutme/srcs/./src/lib.rs').fingerprint, fp)
+        self.assertNotEqual(self.finding(text='b.unwrap()').fingerprint, fp)
+        self.assertNotEqual(self.finding(name='other').fingerprint, fp)
+        self.assertNotEqual(self.finding(filename='src/main.rs').fingerprint, fp)
+
+    def test_batch_diff(self):
+        def batch(*findings):
+            b = model.BatchExec.create(name='diff')
+            dr = ScannerRunner.Create('file:///repo', 'main', 'contract', scanner='test')
+            dr.m.batch = b
+            dr.m.save()
+            model.ScanFinding.Add(dr.m, [f.as_dict() for f in findings])
+            return b
+        old = batch(self.finding(), self.finding(name='fixed'))
+        new = batch(self.finding(lineno=12), self.finding(name='new'))
+        diff = old.diff(new)
+        names = {k: [f.name for _, f in model.ScanFinding.WithScans(ids)] for k, ids in diff.items()}
+        self.assertEqual(names, {'added': ['new'], 'removed': ['fixed'], 'unchanged': ['vuln']})
+        response = get_app().test_client().get(f'/batch/{old.id}/diff/{new.id}?format=json')
+        self.assertEqual(response.json['unchanged'], 1)
+        self.assertEqual([f['name'] for f in response.json['added']], ['new'])
+        self.assertEqual(get_app().test_client().get(f'/batch/{old.id}/diff/{new.id}').status_code, 200)
+        # the same snippet twice in a file: each occurrence counts
+        twice = batch(self.finding(), self.finding(lineno=30), self.finding(name='new'))
+        self.assertEqual({k: len(ids) for k, ids in new.diff(twice).items()},
+                         {'added': 1, 'removed': 0, 'unchanged': 2})
+        self.assertEqual({k: len(ids) for k, ids in twice.diff(new).items()},
+                         {'added': 0, 'removed': 1, 'unchanged': 2})
+
+
+class TestExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+        cls.batch = model.BatchExec.create(name='export')
+        dr = ScannerRunner.Create('https://example.com/org/repo.git', 'main', 'contract', scanner='test')
+        dr.m.batch = cls.batch
+        dr.m.save()
+        model.ScanFinding.Add(dr.m, [
+            TestFingerprints.finding(name='a, "quoted" name').as_dict(),
+            dict(TestFingerprints.finding(name='high').as_dict(), level='High'),
+        ])
+        model.ScanFinding.Add(dr.m, [TestFingerprints.finding(name='so far').as_dict()], partial=True)
+        cls.client = get_app().test_client()
+
+    def get(self, query=''):
+        return self.client.get(f'/batch/{self.batch.id}/composite{query}')
+
+    def test_csv(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(response.text)))
+        self.assertEqual(rows[0][:3], ['scanner', 'repo name', 'repo url'])
+        self.assertEqual([r[6] for r in rows[1:]], ['a, "quoted" name', 'high'])
+        self.assertEqual(rows[1][1], 'repo')
+        self.assertEqual(rows[1][4], '')  # no revision yet
+
+    def test_ndjson_columns_and_filters(self):
+        response = self.get('?format=ndjson&columns=finding,level&level=High')
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual(rows, [{'finding': 'high', 'level': 'High'}])
+        self.assertEqual(self.get('?format=ndjson&scanner=other').text, '')
+
+    def test_partial_findings_on_request(self):
+        self.assertEqual(self.get('?format=ndjson&columns=finding&partial=1').text.count('so far'), 1)
+
+    def test_bad_request(self):
+        self.assertEqual(self.get('?columns=nope').status_code, 400)
+        self.assertEqual(self.get('?format=xls').status_code, 400)
+
+    @unittest.skipIf(export.pyarrow is None, 'pyarrow not installed')
+    def test_parquet(self):
+        import pyarrow.parquet
+        response = self.get('?format=parquet&columns=finding,lineno')
+        table = pyarrow.parquet.read_table(io.BytesIO(response.data))
+        self.assertEqual(table.column('finding').to_pylist(), ['a, "quoted" name', 'high'])
+        self.assertEqual(table.column('lineno').to_pylist(), [10, 10])
+
+
+class TestCompositeCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_invalidated_by_new_findings(self):
+        batch = model.BatchExec.create(name='composite')
+        dr = ScannerRunner.Create('file:///repo', 'main', 'contract', scanner='test')
+        dr.m.batch = batch
+        dr.m.save()
+        model.ScanFinding.Add(dr.m, [TestFingerprints.finding(name='partial').as_dict()], partial=True)
+        self.assertEqual([f['name'] for _, f in batch.composite_report()], ['partial'])
+        cached = model.CompositeReport.get(batch=batch)
+        self.assertEqual(cached.token, batch.change_token())
+        self.assertEqual([(s.id, f['name']) for s, f in batch.composite_report()], [(dr.m.id, 'partial')])
+        model.Report.Create(docker=dr.m, is_raw=True, content='raw')
+        dr.rebuild()
+        self.assertEqual(len(batch.composite_report()), 4)
+        self.assertNotEqual(model.CompositeReport.get(batch=batch).token, cached.token)
+
+
+class TestSidebarCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_version_bumped_on_visible_changes(self):
+        version = model.Counter.Get(model.Counter.SIDEBAR)
+        batch = model.BatchExec.create(name='sidebar')
+        self.assertGreater(model.Counter.Get(model.Counter.SIDEBAR), version)
+        dr = ScannerRunner.Create('file:///repo', 'main', 'contract', scanner='test')
+        dr.m.batch = batch
+        dr.m.save()
+        version = model.Counter.Get(model.Counter.SIDEBAR)
+        dr.set_status(model.ScanStatus.Fetching)
+        self.assertEqual(model.Counter.Get(model.Counter.SIDEBAR), version)
+        scans, batchs = helperfuncs.sidebar()
+        self.assertEqual([b.scan_count for b in batchs if b.id == batch.id], [1])
+        self.assertIs(helperfuncs.sidebar()[1], batchs)
+
+
+class TestBatchSummary(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+        cls.client = get_app().test_client()
+
+    def test_counters_follow_scans(self):
+        batch = model.BatchExec.create(name='summary')
+        runners = [ScannerRunner.Create('file:///repo', 'main', f'contract{n}', scanner='test')
+                   for n in range(3)]
+        for runner in runners:
+            runner.m.batch = batch
+            runner.m.save()
+        runners[0].set_status(model.ScanStatus.Scanning)
+        summary = model.BatchSummary.Get(batch.id)
+        self.assertEqual((summary.total, summary.queued, summary.running), (3, 2, 1))
+        findings = [TestFingerprints.finding(name=f'f{n}', lineno=n).as_dict() for n in range(2)]
+        model.ScanFinding.Add(runners[0].m, findings[:1], partial=True)
+        model.ScanFinding.Replace(runners[0].m, findings)
+        runners[0].set_status(model.ScanStatus.Done)
+        runners[1].set_status(model.ScanStatus.Failed)
+        model.ScannerExec.Cancel(model.ScannerExec.batch == batch)
+        status = self.client.get(f'/batch/{batch.id}/status').json
+        self.assertEqual({k: status[k] for k in ('done', 'failed', 'cancelled', 'queued', 'findings')},
+                         {'done': 1, 'failed': 1, 'cancelled': 1, 'queued': 0, 'findings': 2})
+        self.assertTrue(status['finished'])
+        model.BatchSummary.Rebuild(model.BatchExec.id == batch.id)
+        self.assertEqual(model.BatchSummary.Get(batch.id).as_dict(), status)
+
+
+class TestSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+        cls.client = get_app().test_client()
+
+    def test_indexes_follow_inserts_and_deletes(self):
+        batch = model.BatchExec.create(name='search')
+        scan = model.ScannerExec.create(batch=batch, repo='file:///repo', commit='main', path='c')
+        word = f'zqx{scan.id}'
+        finding = TestFingerprints.finding(name=f'{word}_overflow').as_dict()
+        model.ScanFinding.Replace(scan, [finding])
+        ex = model.Execution.Create('scan', ['true'], scan=scan)
+        model.OutputLine.Create(ex, True, 0, f'error: {word} panicked')
+        hits = self.client.get(f'/api/v1/search?q={word}&batch={batch.id}').json['items']
+        self.assertEqual([(h['scan'], h['name']) for h in hits], [(scan.id, finding['name'])])
+        hits = self.client.get(f'/api/v1/search?q="{word} panicked"&kind=output').json['items']
+        self.assertEqual([h['execution'] for h in hits], [ex.id])
+        self.assertIn(f'<mark>{word}</mark>', self.client.get(f'/search?q={word}').text)
+        model.ScanFinding.Replace(scan, [])
+        self.assertEqual(search.findings(word), [])
+        self.assertEqual(self.client.get('/api/v1/search?q=""').status_code, 400)
+
+
+class TestHttpCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+        cls.client = get_app().test_client()
+
+    def test_finished_exec_output(self):
+        ex = model.Execution.Create('test', ['true'])
+        model.OutputLine.Create(ex, True, 0, 'x' * 5000)
+        url = f'/exec/{ex.id}/output'
+        self.assertIsNone(self.client.get(url).headers.get('ETag'))
+        ex.timestamp = datetime.datetime.now()
+        ex.set_end(0)
+        ex.save()
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.client.get(url, headers={
+            'If-Modified-Since': response.headers['Last-Modified']}).status_code, 304)
+        zipped = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(zipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.data).decode(), 'x' * 5000)
+        self.assertNotEqual(zipped.headers['ETag'], etag)
+        self.assertEqual(self.client.get(url, headers={
+            'If-None-Match': zipped.headers['ETag'], 'Accept-Encoding': 'gzip'}).status_code, 304)
+
+    def test_rebuilt_report_changes_etag(self):
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        model.Report.Create(docker=dr.m, is_raw=True, content='raw')
+        dr.rebuild()
+        url = f'/report/{dr.m.get_common_report().id}/download'
+        etag = self.client.get(url).headers['ETag']
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+        dr.rebuild()
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 200)
+
+
+class TestApi(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+        cls.batch = model.BatchExec.create(name='api')
+        for repo in ('file:///a', 'file:///b', 'file:///a'):
+            dr = ScannerRunner.Create(repo, 'main', '.', scanner='test')
+            dr.m.batch = cls.batch
+            dr.m.save()
+            model.Report.Create(docker=dr.m, is_raw=True, content='raw')
+            dr.rebuild()
+        cls.client = get_app().test_client()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.json)
+        return response.json
+
+    def test_scans_filters_and_fields(self):
+        result = self.get(f'/api/v1/scans?batch={self.batch.id}&repo=file:///a&fields=repo&count=1')
+        self.assertEqual(result['count'], 2)
+        self.assertEqual([set(i) for i in result['items']], [{'id', 'repo'}] * 2)
+
+    def test_findings_cursor(self):
+        url = f'/api/v1/findings?batch={self.batch.id}&level=Low&limit=4&fields=name,scan'
+        first = self.get(url)
+        self.assertEqual(len(first['items']), 4)
+        rest = self.get(url + f'&cursor={first["next_cursor"]}')
+        self.assertIsNone(rest['next_cursor'])
+        ids = [i['id'] for i in first['items'] + rest['items']]
+        self.assertEqual(len(ids), 6)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/v1/scans?fields=nope').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/scans?to=yesterday').status_code, 400)
+        for limit in ('0', '-1'):
+            self.assertEqual(self.client.get(f'/api/v1/scans?limit={limit}').status_code, 400)
+            self.assertEqual(self.client.get(f'/api/v1/search?q=x&limit={limit}').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/batches/0').status_code, 404)
+
+
+class TestSetupBroker(unittest.TestCase):
+    def test_actors_bound_at_startup(self):
+        broker = StubBroker()
+        try:
+            self.assertIs(create_app(broker), get_app())
+            self.assertLessEqual({'default', 'fetch', 'scan', 'process'}, broker.get_declared_queues())
+            drunner.execute_batch.send(0)
+            self.assertEqual(broker.queues['default'].qsize(), 1)
+        finally:
+            drunner.setup_broker(drunner.declaring_broker)
+
+    def test_sends_before_setup_fail(self):
+        with self.assertRaises(errors.BrokerNotSetUp):
+            drunner.execute_batch.send(0)
+        with self.assertRaises(errors.BrokerNotSetUp):
+            dramatiq.Worker(drunner.declaring_broker).start()
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        model.init()
+        tmpdir = tempfile.TemporaryDirectory(prefix='drunner-profiles-')
+        self.addCleanup(tmpdir.cleanup)
+        patch = unittest.mock.patch.multiple(profiling, PROFILE_DIR=tmpdir.name, PROFILE_EVERY=2,
+                                             PROFILE_SLOWER=0)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_every_nth_request(self):
+        client = get_app().test_client()
+        for _ in range(4):
+            client.get('/search?q=nothing')
+        self.assertEqual({p['name'] for p in profiling.profiles()}, {'search'})
+        self.assertEqual(len(profiling.profiles()), 2)
+        slowest = profiling.profiles()[0]
+        self.assertIn(slowest['id'], client.get('/profiles').text)
+        self.assertIn('function calls', client.get(f'/profiles/{slowest["id"]}').text)
+        self.assertEqual(client.get('/profiles/..%2Fsecret').status_code, 404)
+
+    def test_actors_and_slow_calls(self):
+        broker = StubBroker(middleware=[])
+        try:
+            with unittest.mock.patch.object(profiling, 'PROFILE_SLOWER', 1e-9):
+                drunner.setup_broker(broker)
+                worker = dramatiq.Worker(broker, worker_threads=1)
+                worker.start()
+                drunner.execute_batch.send(0, [])
+                broker.join(drunner.execute_batch.queue_name)
+                worker.join()
+                worker.stop()
+        finally:
+            drunner.setup_broker(drunner.declaring_broker)
+        (profile,) = profiling.profiles()
+        self.assertEqual((profile['kind'], profile['name']), ('actor', 'execute_batch'))
+
+    def test_default_actors_include_the_stages(self):
+        self.assertLessEqual({'fetch_source_task', 'run_scanner_task', 'process_report_task'},
+                             set(profiling.PROFILE_ACTORS))
+        self.assertLessEqual(set(profiling.PROFILE_ACTORS),
+                             set(drunner.declaring_broker.get_declared_actors()))
+
+    def test_prune_keeps_the_slowest(self):
+        with unittest.mock.patch.object(profiling, 'PROFILE_KEEP', 2):
+            for duration in (0.3, 0.1, 0.2):
+                profiling.save(cProfile.Profile(), 'test', f'pruned{duration}', '', duration)
+        self.assertEqual([p['duration'] for p in profiling.profiles()], [0.3, 0.2])
+        self.assertEqual(len(os.listdir(profiling.PROFILE_DIR)), 4)
+
+
+class TestBulkSubmit(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def post(self, client, content, filename):
+        form = {'batch': 'bulk', 'from': 'me', 'email': 'me@example.com', 'comments': '',
+                'tasks': '', 'upload': (io.BytesIO(content.encode()), filename)}
+        return client.post('/create/', data=form, content_type='multipart/form-data')
+
+    def test_upload_creates_and_enqueues(self):
+        broker = StubBroker()
+        try:
+            client = create_app(broker).test_client()
+            rows = [{'repo': f'file:///repo{n}', 'path': f'c{n}', 'scanner': 'test'} for n in range(1200)]
+            response = self.post(client, '\n'.join(json.dumps(row) for row in rows), 'scans.ndjson')
+            self.assertEqual(response.status_code, 302)
+            batch_id = int(response.headers['Location'].rstrip('/').split('/')[-1])
+            scans = list(model.ScannerExec.select().where(model.ScannerExec.batch == batch_id)
+                         .order_by(model.ScannerExec.id))
+            self.assertEqual([(s.repo, s.commit, s.path) for s in scans[:1]], [('file:///repo0', 'main', 'c0')])
+            self.assertEqual(model.BatchSummary.Get(batch_id).queued, 1200)
+            message = dramatiq.Message.decode(broker.queues['default'].get_nowait())
+            self.assertEqual(message.args, (batch_id, [s.id for s in scans]))
+            drunner.execute_batch(*message.args)
+            self.assertEqual(broker.queues['default'].qsize(), 1200)
+        finally:
+            drunner.setup_broker(drunner.declaring_broker)
+
+    def test_invalid_definitions_create_nothing(self):
+        batches = model.BatchExec.select().count()
+        response = self.post(get_app().test_client(),
+                             'repo,commit,path,scanner\nfile:///a,main,.,test\n,,,\nfile:///b,main,.,nope\n',
+                             'scans.csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('line 4: Unknown Scanner: nope', response.text)
+        self.assertEqual(model.BatchExec.select().count(), batches)
+
+
+class TestBench(unittest.TestCase):
+    def test_synthetic_reports_parse(self):
+        for version in bench_reports.VERSIONS:
+            runner = bench_suite.scout_runner(version)
+            report = runner.process_report(bench_reports.raw_report(25, version))
+            self.assertEqual(len(report.findings), 25, version)
+            self.assertEqual(report.findings[3].name, bench_reports.CODES[3])
+
+    def test_output_capture(self):
+        model.init()
+        result = bench_output.run_once(2, 300, 60, 0, 0.5)
+        self.assertEqual((result['lines'], result['lost']), (600, 0))
+        self.assertGreater(result['cpu_writer'], 0)
+        self.assertIsNotNone(result['latency_p50'])
+
+    def test_e2e_batch(self):
+        model.init()
+        result = bench_e2e.run(scans=6, repos=2, findings='3', threads=3, log=lambda line: None)
+        (scans,) = result['results'].values()
+        self.assertEqual((scans['done'], scans['unfinished']), (6, 0))
+        self.assertEqual(scans['findings'], 18)
+        self.assertEqual(scans['stages']['docker']['count'], 6)
+
+    def test_compare_flags_regressions(self):
+        def baseline(**medians):
+            return {'results': {k: {'median': v} for k, v in medians.items()}}
+        rows = bench_compare.compare(baseline(a=1.0, b=0.0001, c=1.0, d=1.0),
+                                     baseline(a=1.5, b=0.0003, c=1.1, e=9.0))
+        self.assertEqual([row[0] for row in bench_compare.regressions(rows)], ['a'])
+        self.assertEqual([row[0] for row in rows], ['a', 'b', 'c'])
+
+
+class TestExecLines(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_tail_and_ranges(self):
+        ex = model.Execution.Create('test', ['true'])
+        for idx in range(500):
+            model.OutputLine.Create(ex, True, idx, f'<line {idx}>')
+        page = get_app().test_client().get(f'/exec/{ex.id}').text
+        self.assertEqual(page.count('<div line='), model.Execution.TAIL_LINES)
+        self.assertIn('&lt;line 499&gt;', page)
+        self.assertNotIn('&lt;line 299&gt;', page)
+        client = get_app().test_client()
+        last = client.get(f'/exec/{ex.id}/lines?limit=10').json
+        self.assertEqual([l[2] for l in last['lines']], [f'<line {i}>' for i in range(490, 500)])
+        self.assertFalse(last['finished'])
+        before = client.get(f'/exec/{ex.id}/lines?limit=10&before={last["lines"][0][0]}').json
+        self.assertEqual(before['lines'][-1][2], '<line 489>')
+        after = client.get(f'/exec/{ex.id}/lines?limit=10&after={last["lines"][4][0]}').json
+        self.assertEqual(len(after['lines']), 5)
+        self.assertFalse(after['more'])
+
+
+class TestScanPage(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_raw_report_is_linked(self):
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        raw = model.Report.Create(dr.m, True, '<raw report line>\n' * 1000)
+        page = get_app().test_client().get(f'/scan-exec/{dr.m.id}').text
+        self.assertNotIn('raw report line', page)
+        self.assertIn(f'/report/{raw.id}/download', page)
+
+
+    def test_no_etag_while_executions_run(self):
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        ex = model.Execution.Create('test', ['true'], scan=dr.m)
+        dr.m.set_status(model.ScanStatus.Cancelled)
+        client = get_app().test_client()
+        self.assertIsNone(client.get(f'/scan-exec/{dr.m.id}').headers.get('ETag'))
+        ex.ret = -9
+        ex.save()
+        self.assertIsNotNone(client.get(f'/scan-exec/{dr.m.id}').headers.get('ETag'))
+
+
+class TestRebuildReports(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def setUp(self):
+        self.scans = [ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test') for _ in range(3)]
+        for dr in self.scans:
+            model.Report.Create(docker=dr.m, is_raw=True, content='raw')
+        # no raw report: nothing to rebuild from
+        ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+
+    def stale(self, force=False):
+        ids = [dr.m.id for dr in self.scans]
+        return [id for id in ScannerRunner.StaleScans(force) if id in ids]
+
+    def rebuild(self, force=False, processes=0):
+        job = model.RebuildJob.create(force=force)
+        prev, drunner.REBUILD_PROCESSES = drunner.REBUILD_PROCESSES, processes
+        try:
+            ScannerRunner.RebuildAll(job.id)
+        finally:
+            drunner.REBUILD_PROCESSES = prev
+        return model.RebuildJob.get_by_id(job.id)
+
+    def test_only_stale_reports(self):
+        ids = [dr.m.id for dr in self.scans]
+        self.assertEqual(self.stale(), ids)
+        self.scans[0].rebuild()
+        self.assertEqual(self.stale(), ids[1:])
+        self.assertEqual(self.stale(force=True), ids)
+        job = self.rebuild()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.total, job.done + job.failed)
+        self.assertEqual(self.stale(), [])
+        for dr in self.scans:
+            self.assertEqual(dr.m.findings.count(), 4)
+
+    def test_carried_over_reports_are_not_stale(self):
+        self.scans[0].rebuild()
+        scan = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        scan.m.carry_over(self.scans[0].m)
+        self.assertNotIn(scan.m.id, ScannerRunner.StaleScans())
+        self.assertEqual(scan.m.findings.count(), 4)
+        self.assertEqual(scan.m.get_common_report().timestamp, self.scans[0].m.get_common_report().timestamp)
+
+    def test_parser_version_bump(self):
+        # more than the reports parsed ahead by the pool
+        for _ in range(3):
+            self.scans.append(ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test'))
+            model.Report.Create(docker=self.scans[-1].m, is_raw=True, content='raw')
+        self.rebuild()
+        prev = drunner.TestScanRunner.PARSER_VERSION
+        drunner.TestScanRunner.PARSER_VERSION = prev + 1
+        try:
+            self.assertEqual(len(self.stale()), 6)
+            # the pool's processes must open the same db as this one
+            with unittest.mock.patch.dict(os.environ, {'DB': model.DB_FILE}):
+                job = self.rebuild(processes=2)
+            # other tests' scans get rebuilt too
+            self.assertEqual((job.done, job.failed), (job.total, 0))
+            self.assertEqual(self.stale(), [])
+        finally:
+            drunner.TestScanRunner.PARSER_VERSION = prev
+
+
+class FakeContainer:
+    def __init__(self, out, err, code):
+        self.out, self.err, self.code = out, err, code
+
+    def logs(self, stdout, stderr, stream, follow):
+        return iter([self.out[:5], self.out[5:]] if stdout else [self.err])
+
+    def stats(self, stream, decode):
+        return iter([{'memory_stats': {'usage': 10}, 'cpu_stats': {'cpu_usage': {'total_usage': 10**9}}},
+                     {'memory_stats': {'usage': 30}, 'cpu_stats': {'cpu_usage': {'total_usage': 3*10**9}}},
+                     {'memory_stats': {'usage': 20}}])
+
+    def wait(self, timeout):
+        return {'StatusCode': self.code}
+
+    def remove(self, force):
+        pass
+
+
+class TestDockerApi(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_run_stores_output_and_stats(self):
+        class Containers:
+            def run(self, image, **kwargs):
+                return FakeContainer(b'line 1\nline 2\nline 3', b'oops\n', 3)
+        class Client:
+            containers = Containers()
+        prev, dockerapi._client = dockerapi._client, Client()
+        try:
+            ex = model.Execution.Create('test-docker-api', ['docker run img'])
+            ex = dockerapi.run(ex, 'img')
+        finally:
+            dockerapi._client = prev
+        self.assertEqual(ex.ret, 3)
+        self.assertEqual(sorted(ex.output.splitlines()), ['line 1', 'line 2', 'line 3', 'oops'])
+        self.assertEqual(ex.mem_peak, 30)
+        self.assertEqual(ex.cpu_seconds, 3)
+
+
+def alive(pid):
+    """ running (not just waiting to be reaped) """
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+class TestKillTree(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        model.init()
+
+    def test_timeout_kills_children(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ex = worker.exec('test-timeout', ['sleep 60 & echo $! > child.pid; wait'],
+                             wd=tmpdir, timeout=1)
+            with open(os.path.join(tmpdir, 'child.pid')) as f:
+                child = int(f.read())
+        self.assertEqual(ex.killed, model.Execution.KILLED_TIMEOUT)
+        self.assertNotEqual(ex.ret, 0)
+        self.assertLess(ex.duration, worker.KILL_GRACE + 5)
+        self.assertFalse(alive(child))
+
+    def test_cancel(self):
+        dr = ScannerRunner.Create('file:///nowhere', 'main', '.', scanner='test')
+        model.ScannerExec.Cancel(model.ScannerExec.id == dr.m.id)
+        ex = worker.exec('test-cancel', ['sleep 60'], wd='.', cancelled=dr.m.is_cancelled)
+        self.assertEqual(ex.killed, model.Execution.KILLED_CANCELLED)
+        self.assertFalse(ScannerRunner.RunStage(dr.m.id, 'fetch_source'))
+        self.assertEqual(model.ScannerExec.get_by_id(dr.m.id).status, model.ScanStatus.Cancelled)
+
+
 # class RegressionReport(unittest.TestCase):
 #     def test_me(self):
 #         scan = ScannerRunner.FromId(224)
@@ -1,18 +1,23 @@
 import datetime
 import json
 import os
+import signal
 import time
 from queue import Queue
 import queue
 import sys
 import threading
 from contextlib import contextmanager
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, TimeoutExpired
 
 from model import Execution, OutputLine, db, ScannerExec
 
 
 BSIZE = 100
+# how often a running command checks for timeout / cancellation (seconds)
+POLL_INTERVAL = 1
+# time given to the process group to exit after SIGTERM before SIGKILL
+KILL_GRACE = 5
 
 
 def add_line(ex, is_out, idx, line):
@@ -25,15 +30,18 @@ def db_save(q, debug=None):
     tot = 0
     done = False
     while not done:
-        lines = []
-        while not q.empty():
-            new_lines = q.get()
-            done = new_lines is None
-            if done:
-                break
+        # waits for lines, then takes the ones queued meanwhile too: None (the
+        # readers are done) is the last item queued
+        new_lines, lines = q.get(), []
+        while new_lines is not None:
             lines += new_lines
+            try:
+                new_lines = q.get_nowait()
+            except queue.Empty:
+                break
+        done = new_lines is None
         if lines:
-            with db.atomic():
+            with db.atomic(lock_type='IMMEDIATE'):
                 for idx in range(0, len(lines), BSIZE):
                     OutputLine.insert_many(lines[idx:idx + BSIZE]).execute()
                     tot += len(lines[idx:idx + BSIZE])
@@ -79,14 +87,48 @@ def launch_thread(*args):
         thread.join()
 
 
-def _exec(ex: Execution, cmdargs, wd='.', env=None, debug=None) -> Execution:
+def wait(p: Popen, timeout=None, cancelled=None):
+    """ wait for p to finish, returns None if it did or why it must be killed """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            p.wait(POLL_INTERVAL)
+            return None
+        except TimeoutExpired:
+            pass
+        if deadline is not None and time.time() > deadline:
+            return Execution.KILLED_TIMEOUT
+        if cancelled is not None and cancelled():
+            return Execution.KILLED_CANCELLED
+
+
+def kill_tree(p: Popen, on_kill=None):
+    """ kill the shell and everything it started (it leads its own process group) """
+    if on_kill is not None:
+        try:
+            on_kill()
+        except Exception as err:
+            print(f"Error while killing: {err}", file=sys.stderr)
+    try:
+        os.killpg(p.pid, signal.SIGTERM)
+        p.wait(KILL_GRACE)
+    except TimeoutExpired:
+        os.killpg(p.pid, signal.SIGKILL)
+        p.wait()
+    except ProcessLookupError:
+        pass
+
+
+def _exec(ex: Execution, cmdargs, wd='.', env=None, debug=None,
+          timeout=None, cancelled=None, on_kill=None) -> Execution:
     if not (env is None):
         base = os.environ.copy()
         base.update(env)
         env = base
     ex.timestamp = datetime.datetime.now()
     ex.save()
-    p = Popen(cmdargs, cwd=wd, env=env, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True)
+    p = Popen(cmdargs, cwd=wd, env=env, shell=True, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True,
+              start_new_session=True)
     (child_stdin, child_stdout, child_stderr) = (p.stdin, p.stdout, p.stderr)
     q = Queue()
     thread = threading.Thread(target=db_save, args=(q, debug))
@@ -94,22 +136,32 @@ def _exec(ex: Execution, cmdargs, wd='.', env=None, debug=None) -> Execution:
     try:
         with launch_thread(ex, child_stdout, True, q):
             with launch_thread(ex, child_stderr, False, q):
-                p.wait()
+                try:
+                    ex.killed = wait(p, timeout, cancelled)
+                except BaseException:
+                    # ie: dramatiq's time limit, don't leave the children behind
+                    ex.killed = Execution.KILLED_INTERRUPTED
+                    raise
+                finally:
+                    if ex.killed is not None:
+                        kill_tree(p, on_kill)
     except Exception as e:
         print(f"Error while running: {e}", file=sys.stderr)
     finally:
         q.put(None)
+        # all the output is saved before ret: a finished execution's output never changes
+        thread.join()
         ex.set_end(p.returncode)
         try:
             ex.save()
         except Exception as err:
             print(f"Failed to save: {err}", file=sys.stderr)
-        thread.join()
     return ex
 
 
 # @dramatiq.actor
-def exec(kind, cmdargs=None, wd=None, env=None, de: ScannerExec=None, e:Execution=None) -> Execution:
+def exec(kind, cmdargs=None, wd=None, env=None, de: ScannerExec=None, e:Execution=None,
+         timeout=None, cancelled=None, on_kill=None) -> Execution:
     if e is None and cmdargs is None:
         raise Exception("Either cmdargs or cmdargs must not be None")
     if e is None:
@@ -118,7 +170,8 @@ def exec(kind, cmdargs=None, wd=None, env=None, de: ScannerExec=None, e:Executio
         e.wd = wd
         cmdargs = json.loads(e.cmdargs)
         e.save()
-    e = _exec(e, cmdargs=cmdargs, wd=wd, env=env)
+    e = _exec(e, cmdargs=cmdargs, wd=wd, env=env,
+              timeout=timeout, cancelled=cancelled, on_kill=on_kill)
     e.save()
     return Execution.get_by_id(e.id)
 